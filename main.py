@@ -7,8 +7,15 @@ from typing import Any, cast
 import uvicorn
 from dotenv import load_dotenv
 
+from src.db.activities import activity_tree
+from src.db.bitmaps import activity_bitmaps
+from src.db.facets import activity_facets
+from src.db.names import name_index
 from src.db.pre_load import run_fixtures
 from src.db.session import AsyncSessionLocal
+from src.db.snapshot import snapshot
+from src.db.spatial import spatial_index
+from src.db.tiles import tile_index
 
 load_dotenv()
 
@@ -17,6 +24,9 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware as CORS_Middleware
 from starlette.requests import Request
 
+from src.routes.cache import router as router_cache
+from src.routes.cursor import NEXT_CURSOR_HEADER
+from src.routes.imports import router as router_import
 from src.routes.routes import router as routes
 from src.routes.logs import router as router_logs
 
@@ -34,10 +44,13 @@ async def lifespan(app: FastAPI):
         if not result.scalars().first():
             await run_fixtures(session, "./static/fixtures.json")
             logger.info("Fixtures loaded during startup")
+        for index in (snapshot, spatial_index, tile_index, activity_tree, activity_facets,
+                      activity_bitmaps, name_index):
+            await index.ensure(session)
     yield
     logger.info("Shutting down application")
 
-app = FastAPI(title="Встречи API", version="1.0.0")
+app = FastAPI(title="Встречи API", version="1.0.0", lifespan=lifespan)
 
 origins = [
     "http://localhost:5173",
@@ -54,11 +67,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
 )
 
 # ---------------------- #
 app.include_router(routes)
+app.include_router(router_import)
 app.include_router(router_logs)
+app.include_router(router_cache)
 
 
 logger = logging.getLogger(__name__)
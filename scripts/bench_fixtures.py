@@ -0,0 +1,161 @@
+"""
+Сравнение загрузчиков фикстур на синтетических данных.
+
+    python -m scripts.bench_fixtures --organizations 100000
+
+Генерирует файл фикстур (здания, виды деятельности из static/fixtures.json, организации,
+по два телефона и по два вида деятельности на организацию), загружает его прежним ORM-загрузчиком
+и потоковым загрузчиком в БД из настроек и печатает время; с --memory - ещё и пиковую память Python
+(tracemalloc заметно замедляет оба загрузчика, поэтому память меряется отдельным прогоном).
+Таблицы фикстур перезаписываются!
+"""
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+from pathlib import Path
+from uuid import UUID
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.db.models import (
+    Activity,
+    Building,
+    Organization,
+    OrganizationActivity,
+    OrganizationPhone,
+)
+from src.db.pre_load import load_json_fixtures
+from src.db.session import AsyncSessionLocal
+
+CREATED_AT = "2025-08-05T14:27:00Z"
+
+
+async def load_json_fixtures_orm(session: AsyncSession, json_file_path: str):
+    """Прежний загрузчик из src/db/pre_load.py - для сравнения:
+    json.load всего файла и ORM-объект на каждую запись"""
+    try:
+        for table in [OrganizationActivity, OrganizationPhone, Organization, Activity, Building]:
+            await session.execute(table.__table__.delete())
+        await session.commit()
+
+        with open(json_file_path, encoding='utf-8') as f:
+            data = json.load(f)
+
+        for building_data in data.get('buildings', []):
+            session.add(Building(
+                id=UUID(building_data['id']),
+                address=building_data['address'],
+                latitude=building_data['latitude'],
+                longitude=building_data['longitude'],
+                created_at=datetime.fromisoformat(building_data['created_at']),
+            ))
+        await session.flush()
+
+        for activity_data in data.get('activities', []):
+            session.add(Activity(
+                id=UUID(activity_data['id']),
+                name=activity_data['name'],
+                parent_id=UUID(activity_data['parent_id']) if activity_data['parent_id'] else None,
+                level=activity_data['level'],
+                created_at=datetime.fromisoformat(activity_data['created_at']),
+            ))
+        await session.flush()
+
+        for org_data in data.get('organizations', []):
+            session.add(Organization(
+                id=UUID(org_data['id']),
+                name=org_data['name'],
+                building_id=UUID(org_data['building_id']),
+                created_at=datetime.fromisoformat(org_data['created_at']),
+            ))
+        await session.flush()
+
+        for phone_data in data.get('organization_phones', []):
+            session.add(OrganizationPhone(
+                organization_id=UUID(phone_data['organization_id']),
+                phone_number=phone_data['phone_number'],
+                created_at=datetime.fromisoformat(phone_data['created_at']),
+            ))
+        await session.flush()
+
+        for org_activity_data in data.get('organization_activities', []):
+            session.add(OrganizationActivity(
+                organization_id=UUID(org_activity_data['organization_id']),
+                activity_id=UUID(org_activity_data['activity_id']),
+                created_at=datetime.fromisoformat(org_activity_data['created_at']),
+            ))
+        await session.flush()
+
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+
+
+def generate(path: Path, organizations: int):
+    activities = json.loads(Path("static/fixtures.json").read_text(encoding="utf-8"))["activities"]
+    leaves = [activity["id"] for activity in activities]
+    buildings = [str(uuid.uuid4()) for _ in range(max(1, organizations // 10))]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{"buildings": [')
+        f.write(",".join(json.dumps({"id": building_id, "address": f"ул. Тестовая, {i}",
+                                     "latitude": random.uniform(55.5, 56.0), "longitude": random.uniform(37.3, 37.9),
+                                     "created_at": CREATED_AT})
+                         for i, building_id in enumerate(buildings)))
+        f.write('], "activities": ')
+        f.write(json.dumps(activities, ensure_ascii=False))
+        org_ids = [str(uuid.uuid4()) for _ in range(organizations)]
+        f.write(', "organizations": [')
+        f.write(",".join(json.dumps({"id": org_id, "name": f"Организация {i}", "building_id": random.choice(buildings),
+                                     "created_at": CREATED_AT}, ensure_ascii=False)
+                         for i, org_id in enumerate(org_ids)))
+        f.write('], "organization_phones": [')
+        f.write(",".join(json.dumps({"organization_id": org_id, "phone_number": f"{i}-{n}", "created_at": CREATED_AT})
+                         for i, org_id in enumerate(org_ids) for n in range(2)))
+        f.write('], "organization_activities": [')
+        f.write(",".join(json.dumps({"organization_id": org_id, "activity_id": activity_id, "created_at": CREATED_AT})
+                         for org_id in org_ids for activity_id in random.sample(leaves, 2)))
+        f.write(']}')
+
+
+async def measure(loader, path: Path) -> float:
+    started = time.perf_counter()
+    async with AsyncSessionLocal() as session:
+        await loader(session, str(path))
+    return time.perf_counter() - started
+
+
+async def measure_memory(loader, path: Path) -> float:
+    """Пиковая память Python в МБ"""
+    tracemalloc.start()
+    try:
+        await measure(loader, path)
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--organizations", type=int, default=10_000)
+    parser.add_argument("--memory", action="store_true", help="измерить пиковую память")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "fixtures.json"
+        generate(path, args.organizations)
+        print(f"Файл фикстур: {path.stat().st_size / 2 ** 20:.1f} МБ, организаций: {args.organizations}")
+        for name, loader in (("ORM", load_json_fixtures_orm), ("потоковый", load_json_fixtures)):
+            seconds = await measure(loader, path)
+            memory = f", пик памяти {await measure_memory(loader, path):8.1f} МБ" if args.memory else ""
+            print(f"{name:>10}: {seconds:8.2f} с ({args.organizations / seconds:.0f} организаций/с){memory}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,45 @@
+"""building geohash
+
+Revision ID: 3f9c2a7d1b84
+Revises: 065d0ff6387b
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from src.core.geo import geohash
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9c2a7d1b84'
+down_revision: Union[str, Sequence[str], None] = '065d0ff6387b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('building', sa.Column('geohash', sa.Text(collation='C'), nullable=True, comment='Geohash координат'))
+
+    # backfill существующих зданий
+    conn = op.get_bind()
+    rows = conn.execute(sa.text("SELECT id, latitude, longitude FROM building")).all()
+    if rows:
+        conn.execute(
+            sa.text("UPDATE building SET geohash = :geohash WHERE id = :id"),
+            [{"id": row.id, "geohash": geohash(row.latitude, row.longitude)} for row in rows],
+        )
+
+    op.alter_column('building', 'geohash', nullable=False)
+    op.create_index(op.f('ix_building_geohash'), 'building', ['geohash'], unique=False)
+    op.create_index(op.f('ix_organization_building_id'), 'organization', ['building_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_organization_building_id'), table_name='organization')
+    op.drop_index(op.f('ix_building_geohash'), table_name='building')
+    op.drop_column('building', 'geohash')
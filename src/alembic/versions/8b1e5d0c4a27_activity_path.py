@@ -0,0 +1,45 @@
+"""activity materialized path
+
+Revision ID: 8b1e5d0c4a27
+Revises: 3f9c2a7d1b84
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b1e5d0c4a27'
+down_revision: Union[str, Sequence[str], None] = '3f9c2a7d1b84'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('activity', sa.Column('path', sa.Text(collation='C'), nullable=True,
+                                        comment='Материализованный путь: /id корня/.../id/'))
+    op.execute("""
+        WITH RECURSIVE tree(id, path) AS (
+            SELECT id, '/' || id::text || '/' FROM activity WHERE parent_id IS NULL
+            UNION ALL
+            SELECT a.id, t.path || a.id::text || '/' FROM activity a JOIN tree t ON a.parent_id = t.id
+        )
+        UPDATE activity SET path = tree.path FROM tree WHERE activity.id = tree.id
+    """)
+    op.alter_column('activity', 'path', nullable=False)
+    op.create_index(op.f('ix_activity_path'), 'activity', ['path'], unique=False)
+    op.create_index(op.f('ix_organization_activity_activity_id'), 'organization_activity', ['activity_id'], unique=False)
+    op.create_index(op.f('ix_organization_activity_organization_id'), 'organization_activity', ['organization_id'],
+                    unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_organization_activity_organization_id'), table_name='organization_activity')
+    op.drop_index(op.f('ix_organization_activity_activity_id'), table_name='organization_activity')
+    op.drop_index(op.f('ix_activity_path'), table_name='activity')
+    op.drop_column('activity', 'path')
@@ -0,0 +1,46 @@
+"""organization search name
+
+Revision ID: c4d7e2a9f015
+Revises: 8b1e5d0c4a27
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from src.core.search import normalize
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4d7e2a9f015'
+down_revision: Union[str, Sequence[str], None] = '8b1e5d0c4a27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.add_column('organization', sa.Column('search_name', sa.Text(), nullable=True,
+                                            comment='Название для поиска: нижний регистр, ё -> е, без знаков препинания'))
+
+    # backfill существующих организаций
+    conn = op.get_bind()
+    rows = conn.execute(sa.text("SELECT id, name FROM organization")).all()
+    if rows:
+        conn.execute(
+            sa.text("UPDATE organization SET search_name = :search_name WHERE id = :id"),
+            [{"id": row.id, "search_name": normalize(row.name)} for row in rows],
+        )
+
+    op.alter_column('organization', 'search_name', nullable=False)
+    op.create_index('ix_organization_search_name', 'organization', ['search_name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'search_name': 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_organization_search_name', table_name='organization')
+    op.drop_column('organization', 'search_name')
@@ -29,6 +29,27 @@ class Settings(BaseSettings):
 
     LOG_PATH: str = ""
 
+    # Максимальная глубина дерева видов деятельности
+    ACTIVITY_MAX_LEVEL: int = 3
+
+    # Порог похожести слова при поиске по названию (pg_trgm word_similarity):
+    # 0.4 пропускает одну опечатку в слове из 6 букв
+    NAME_SIMILARITY_THRESHOLD: float = 0.4
+
+    # Отдавать строки из БД сразу в JSON, без повторной проверки по модели ответа
+    FAST_JSON: bool = False
+
+    # Кэш ответов GET-маршрутов: записей в LRU (0 - выключен), суммарный размер тел и самое большое
+    # кэшируемое тело, байт, время жизни записи, с
+    RESPONSE_CACHE_SIZE: int = 1024
+    RESPONSE_CACHE_BYTES: int = 64 << 20
+    RESPONSE_CACHE_MAX_BODY: int = 1 << 20
+    RESPONSE_CACHE_TTL: float = 60.0
+
+    # Каталог общего для воркеров снимка справочных данных (snapshot.py) и журнала изменений (journal.py).
+    # Пусто - оба выключены: индексы в памяти, ETag и кэш ответов верны только при одном воркере
+    SNAPSHOT_DIR: str = ""
+
     # Автоматическое формирование DSN для БД
     @computed_field
     @property
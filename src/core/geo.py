@@ -0,0 +1,206 @@
+"""Геометрия для гео-поиска"""
+import math
+from collections.abc import Iterable
+from typing import Literal
+
+import numpy as np
+from geopy.distance import geodesic
+
+# Нижние оценки длины градуса на эллипсоиде WGS84, км (с небольшим запасом вниз).
+# Градус широты короче всего на экваторе (110.574 км),
+# градус долготы на широте φ не короче 111.320·cos(φ) км.
+KM_PER_DEG_LAT = 110.5
+KM_PER_DEG_LON = 111.2
+
+EARTH_RADIUS_KM = 6371.0088  # средний радиус Земли (IUGG)
+HALF_CIRCUMFERENCE_KM = 20_100.0  # больше любого расстояния между точками на Земле
+
+Box = tuple[float, float, float, float]  # lat_min, lat_max, lon_min, lon_max
+MERCATOR_MAX_LAT = 85.05112878  # граница проекции Web Mercator
+MAX_ZOOM = 18  # наибольший масштаб тайлов карты
+TILE_CELL_BITS = 3  # тайл делится на 2^3 x 2^3 ячеек - это тайлы уровня z + TILE_CELL_BITS
+
+GRID_CELL_DEG = 0.05  # сторона ячейки сетки зданий (пространственный индекс), градусов
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 12  # символов geohash, хранимых у здания (ячейка ~4 см)
+GEOHASH_MAX_CELLS = 32  # ячеек в покрытии прямоугольника - столько диапазонов уйдёт в SQL
+
+Polygon = list[tuple[float, float]]  # вершины (широта, долгота), без повтора первой в конце
+
+# Режим расчёта расстояний:
+#   exact - геодезическая на эллипсоиде WGS84 (формула Винсенти, погрешность ~1e-6 км; почти
+#           антиподальные точки, где она не сходится, - geopy, алгоритм Karney);
+#   fast  - гаверсинус на сфере среднего радиуса, относительная погрешность не больше SPHERE_ERROR
+#           (не больше 57 м на 10 км) - разница между сферой и эллипсоидом.
+# Оба режима считаются сразу для всего массива точек (numpy), без цикла Python по точкам.
+Accuracy = Literal["fast", "exact"]
+SPHERE_ERROR = 0.0057
+
+WGS84_A_KM = 6378.137  # большая полуось эллипсоида WGS84
+WGS84_F = 1 / 298.257223563  # сжатие
+VINCENTY_ITERATIONS = 200
+VINCENTY_TOLERANCE = 1e-12  # радиан разности долгот на вспомогательной сфере, ~0.006 мм
+
+
+def bounding_boxes(latitude: float, longitude: float, radius_km: float,
+                   accuracy: Accuracy = "exact") -> list[Box]:
+    """Прямоугольники, которые гарантированно покрывают круг радиуса radius_km вокруг точки.
+    Рамка консервативная: любая точка на расстоянии <= radius_km попадает в неё.
+    При переходе через антимеридиан возвращается два прямоугольника."""
+    if accuracy == "fast":  # сферическое расстояние может быть меньше геодезического
+        radius_km *= 1 + SPHERE_ERROR
+    d_lat = radius_km / KM_PER_DEG_LAT
+    lat_min, lat_max = latitude - d_lat, latitude + d_lat
+    if lat_min <= -90 or lat_max >= 90:
+        return [(max(lat_min, -90.0), min(lat_max, 90.0), -180.0, 180.0)]
+
+    # кратчайший путь не выходит из полосы широт, поэтому берём самый короткий градус долготы в ней
+    cos_lat = math.cos(math.radians(max(abs(lat_min), abs(lat_max))))
+    d_lon = radius_km / (KM_PER_DEG_LON * cos_lat)
+    if d_lon >= 180:
+        return [(lat_min, lat_max, -180.0, 180.0)]
+
+    lon_min, lon_max = longitude - d_lon, longitude + d_lon
+    if lon_min < -180:
+        return [(lat_min, lat_max, lon_min + 360, 180.0), (lat_min, lat_max, -180.0, lon_max)]
+    if lon_max > 180:
+        return [(lat_min, lat_max, lon_min, 180.0), (lat_min, lat_max, -180.0, lon_max - 360)]
+    return [(lat_min, lat_max, lon_min, lon_max)]
+
+
+def _haversine_km(lat0: float, lon0: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    h = np.sin((lats - lat0) / 2) ** 2 + math.cos(lat0) * np.cos(lats) * np.sin((lons - lon0) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(h)))
+
+
+def _vincenty_km(lat0: float, lon0: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Обратная задача Винсенти на WGS84; NaN - итерации не сошлись (почти антиподальные точки)"""
+    b = WGS84_A_KM * (1 - WGS84_F)
+    u0 = math.atan((1 - WGS84_F) * math.tan(lat0))
+    sin_u0, cos_u0 = math.sin(u0), math.cos(u0)
+    u = np.arctan((1 - WGS84_F) * np.tan(lats))
+    sin_u, cos_u = np.sin(u), np.cos(u)
+    diff = np.remainder(lons - lon0 + math.pi, 2 * math.pi) - math.pi
+    lam = diff
+    converged = np.zeros(lam.shape, dtype=bool)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for _ in range(VINCENTY_ITERATIONS):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cos_u * sin_lam, cos_u0 * sin_u - sin_u0 * cos_u * cos_lam)
+            cos_sigma = sin_u0 * sin_u + cos_u0 * cos_u * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u0 * cos_u * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            # на экваторе cos2_alpha = 0 и средняя точка дуги не определена
+            cos_2sm = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_u0 * sin_u / cos2_alpha)
+            c = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+            previous, lam = lam, diff + (1 - c) * WGS84_F * sin_alpha * (
+                sigma + c * sin_sigma * (cos_2sm + c * cos_sigma * (2 * cos_2sm ** 2 - 1)))
+            converged = np.abs(lam - previous) <= VINCENTY_TOLERANCE
+            if converged.all():
+                break
+    u2 = cos2_alpha * (WGS84_A_KM ** 2 - b ** 2) / b ** 2
+    big_a = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    big_b = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = big_b * sin_sigma * (cos_2sm + big_b / 4 * (
+        cos_sigma * (2 * cos_2sm ** 2 - 1) - big_b / 6 * cos_2sm * (4 * sin_sigma ** 2 - 3) * (4 * cos_2sm ** 2 - 3)))
+    return np.where(converged, b * big_a * (sigma - delta_sigma), np.nan)
+
+
+def distances_km(latitude: float, longitude: float,
+                 points: Iterable[tuple[float, float]],
+                 accuracy: Accuracy = "exact") -> list[float]:
+    """Расстояния в км от точки до каждой из points (широта, долгота) одним проходом"""
+    coords = np.radians(np.array(list(points), dtype=float).reshape(-1, 2))
+    lat0, lon0 = math.radians(latitude), math.radians(longitude)
+    if accuracy == "fast":
+        return _haversine_km(lat0, lon0, coords[:, 0], coords[:, 1]).tolist()
+
+    result = _vincenty_km(lat0, lon0, coords[:, 0], coords[:, 1])
+    center = (latitude, longitude)
+    for i in np.flatnonzero(np.isnan(result)):
+        result[i] = geodesic(center, np.degrees(coords[i]).tolist()).kilometers
+    return result.tolist()
+
+
+def polygon_box(polygon: Polygon) -> Box:
+    """Описанный прямоугольник многоугольника"""
+    lats, lons = [lat for lat, _ in polygon], [lon for _, lon in polygon]
+    return min(lats), max(lats), min(lons), max(lons)
+
+
+def points_in_polygon(points: Iterable[tuple[float, float]], polygon: Polygon) -> np.ndarray:
+    """Попадание точек (широта, долгота) в многоугольник - чётность пересечений луча с рёбрами.
+    Луч от каждого ребра проверяется сразу для всего массива точек, горизонтальные рёбра отбрасываются."""
+    coords = np.array(list(points), dtype=float).reshape(-1, 2)
+    lats, lons = coords[:, 0], coords[:, 1]
+    inside = np.zeros(len(coords), dtype=bool)
+    for (lat1, lon1), (lat2, lon2) in zip(polygon, polygon[1:] + polygon[:1], strict=True):
+        if lat1 != lat2:
+            slope = (lon2 - lon1) / (lat2 - lat1)
+            inside ^= ((lat1 > lats) != (lat2 > lats)) & (lons < lon1 + (lats - lat1) * slope)
+    return inside
+
+
+def grid_cell(latitude: float, longitude: float, cell_deg: float = GRID_CELL_DEG) -> tuple[int, int]:
+    """Ячейка сетки cell_deg x cell_deg градусов, в которой лежит точка"""
+    return math.floor(latitude / cell_deg), math.floor(longitude / cell_deg)
+
+
+def mercator_cell(latitude: float, longitude: float, zoom: int) -> tuple[int, int]:
+    """Номер тайла (x, y) Web Mercator на уровне масштаба zoom, в котором лежит точка"""
+    n = 1 << zoom
+    lat = math.radians(min(max(latitude, -MERCATOR_MAX_LAT), MERCATOR_MAX_LAT))
+    x = (longitude + 180) / 360 * n
+    y = (1 - math.log(math.tan(lat) + 1 / math.cos(lat)) / math.pi) / 2 * n
+    return min(int(x), n - 1), min(max(int(y), 0), n - 1)
+
+
+def _geohash_bits(precision: int) -> tuple[int, int]:
+    """Число бит широты и долготы в geohash длины precision (биты чередуются, первый - долгота)"""
+    bits = 5 * precision
+    return bits // 2, bits - bits // 2
+
+
+def _geohash_index(value: float, low: float, high: float, bits: int) -> int:
+    return min(max(int((value - low) / (high - low) * (1 << bits)), 0), (1 << bits) - 1)
+
+
+def _geohash_from_index(lat_i: int, lon_i: int, precision: int) -> str:
+    lat_bits, lon_bits = _geohash_bits(precision)
+    code = 0
+    for bit in range(5 * precision):
+        if bit % 2 == 0:
+            lon_bits -= 1
+            code = code << 1 | (lon_i >> lon_bits) & 1
+        else:
+            lat_bits -= 1
+            code = code << 1 | (lat_i >> lat_bits) & 1
+    return "".join(GEOHASH_ALPHABET[code >> 5 * i & 31] for i in reversed(range(precision)))
+
+
+def geohash(latitude: float, longitude: float, precision: int = GEOHASH_PRECISION) -> str:
+    """Geohash точки"""
+    lat_bits, lon_bits = _geohash_bits(precision)
+    return _geohash_from_index(
+        _geohash_index(latitude, -90, 90, lat_bits),
+        _geohash_index(longitude, -180, 180, lon_bits),
+        precision,
+    )
+
+
+def geohash_cover(lat_min: float, lat_max: float, lon_min: float, lon_max: float) -> list[str]:
+    """Префиксы geohash, ячейки которых покрывают прямоугольник.
+    Берётся самая мелкая точность, при которой ячеек не больше GEOHASH_MAX_CELLS."""
+    if lat_min > lat_max or lon_min > lon_max:
+        return []
+    cells: list[str] = []
+    for precision in range(1, GEOHASH_PRECISION + 1):
+        lat_bits, lon_bits = _geohash_bits(precision)
+        lat_i = range(_geohash_index(lat_min, -90, 90, lat_bits), _geohash_index(lat_max, -90, 90, lat_bits) + 1)
+        lon_i = range(_geohash_index(lon_min, -180, 180, lon_bits), _geohash_index(lon_max, -180, 180, lon_bits) + 1)
+        if len(lat_i) * len(lon_i) > GEOHASH_MAX_CELLS and cells:
+            break
+        cells = [_geohash_from_index(i, j, precision) for i in lat_i for j in lon_i]
+    return sorted(cells)
@@ -0,0 +1,10 @@
+"""Нормализация названий для поиска"""
+import re
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize(text: str) -> str:
+    """Нижний регистр, ё -> е, знаки препинания и кавычки -> пробел, одиночные пробелы.
+    Так хранится search_name организации и так же приводится строка поиска."""
+    return _NON_WORD.sub(" ", text.casefold().replace("ё", "е")).strip()
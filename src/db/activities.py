@@ -0,0 +1,85 @@
+"""Дерево видов деятельности в памяти"""
+from bisect import bisect_left
+from typing import NamedTuple
+from uuid import UUID
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .memory import MemoryIndex
+from .models import Activity
+from .snapshot import snapshot
+
+
+class ActivityNode(NamedTuple):
+    id: UUID
+    name: str
+    parent_id: UUID | None
+    level: int
+    path: str
+
+
+class ActivityTree(MemoryIndex):
+    """Снимок таблицы activity: узлы по id, дети узла и поддеревья.
+    Таблица маленькая и меняется редко, поэтому любое изменение перечитывает её целиком."""
+    keys = {Activity: "id"}
+
+    def __init__(self):
+        super().__init__()
+        self._nodes: dict[UUID, ActivityNode] = {}
+        self._children: dict[UUID, list[UUID]] = {}
+        self._paths: list[str] = []  # пути всех узлов по возрастанию - поддерево занимает непрерывный отрезок
+        self._ordered: list[UUID] = []
+
+    async def load(self, session: AsyncSession):
+        if (snap := await snapshot.read(session)) is not None:
+            # те же операции над представлениями снимка - узлы не копируются в память процесса
+            self._nodes = snap.activity_nodes(ActivityNode)
+            self._children = snap.activity_children
+            self._paths = snap.activity_paths
+            self._ordered = snap.activity_ids
+            return
+        stmt = select(Activity.id, Activity.name, Activity.parent_id, Activity.level, Activity.path)
+        result = await session.execute(stmt.order_by(Activity.path))
+        nodes = [ActivityNode(*row) for row in result.all()]
+        children: dict[UUID, list[UUID]] = {}
+        for node in nodes:
+            if node.parent_id is not None:
+                children.setdefault(node.parent_id, []).append(node.id)
+        self._nodes = {node.id: node for node in nodes}
+        self._children = children
+        self._paths = [node.path for node in nodes]
+        self._ordered = [node.id for node in nodes]
+
+    def get(self, activity_id: UUID) -> ActivityNode | None:
+        return self._nodes.get(activity_id)
+
+    def children(self, activity_id: UUID) -> list[UUID]:
+        return self._children.get(activity_id, [])
+
+    def ancestors(self, activity_id: UUID) -> list[UUID]:
+        """Узел и все его предки до корня"""
+        ids = []
+        while (node := self._nodes.get(activity_id)) is not None:
+            ids.append(node.id)
+            activity_id = node.parent_id
+        return ids
+
+    def nodes(self, max_level: int | None = None) -> list[ActivityNode]:
+        """Все узлы в порядке обхода дерева (по пути)"""
+        nodes = (self._nodes[node_id] for node_id in self._ordered)
+        return [node for node in nodes if max_level is None or node.level <= max_level]
+
+    def subtree(self, activity_id: UUID, max_level: int | None = None) -> list[UUID]:
+        """Узел и все его потомки (не глубже max_level)"""
+        if not (node := self._nodes.get(activity_id)):
+            return []
+        start = bisect_left(self._paths, node.path)
+        end = bisect_left(self._paths, node.path + "~")  # "~" больше любого символа пути
+        ids = self._ordered[start:end]
+        if max_level is not None:
+            ids = [node_id for node_id in ids if self._nodes[node_id].level <= max_level]
+        return ids
+
+
+activity_tree = ActivityTree()
@@ -1,9 +1,11 @@
 import logging
-from typing import ClassVar, List, Optional, Self
+from datetime import datetime
+from functools import cache
+from typing import Callable, ClassVar, List, Optional, Self, Sequence
 from uuid import UUID
 
 import uuid6
-from sqlalchemy import Uuid, delete, select
+from sqlalchemy import Column, Select, Uuid, delete, select
 from sqlalchemy.exc import MultipleResultsFound, NoResultFound
 from sqlalchemy.ext.asyncio import AsyncAttrs, AsyncSession
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
@@ -20,14 +22,53 @@ class Base(AsyncAttrs, DeclarativeBase):
 
     er_404: ClassVar[E] = E.ER_NOT_ITEM  # ошибка, если запись не найдена
     joins: ClassVar[tuple[str, ...]] = tuple()  # связанные таблицы, данные из которых надо подгружать при запросе
-    _exclude: ClassVar[tuple[str, ...]] = tuple()
+    _exclude: ClassVar[tuple[str, ...]] = tuple()  # служебные колонки, которые не отдаются наружу
 
     def fields(self) -> dict:
         return {
             column.key: getattr(self, column.key)
-            for column in self.__table__.columns
+            for column in self.read_columns()
         }
 
+    @classmethod
+    @cache
+    def read_columns(cls) -> tuple[Column, ...]:
+        """Колонки, которые читаются и отдаются наружу"""
+        return tuple(column for column in cls.__table__.columns if column.key not in cls._exclude)
+
+    @classmethod
+    @cache
+    def converter(cls) -> Callable[[Sequence], dict]:
+        """Преобразователь строки select_fields() в словарь. Ключи вычисляются один раз на модель;
+        строка может продолжаться другими колонками - они не попадают в словарь"""
+        keys = tuple(column.key for column in cls.read_columns())
+        return lambda row: dict(zip(keys, row, strict=False))
+
+    @classmethod
+    def record(cls, created_at: datetime, **values) -> dict:
+        """Строка таблицы целиком для Core-вставки и COPY - они не вычисляют значения по умолчанию:
+        id создаётся, если не передан, служебные колонки заполняет computed() модели"""
+        values["id"] = values.get("id") or uuid6.uuid7()
+        return {**values, **cls.computed(values), "created_at": created_at}
+
+    @classmethod
+    def computed(cls, values: dict) -> dict:
+        """Служебные колонки, которые выводятся из остальных значений строки"""
+        return {}
+
+    @classmethod
+    def select_fields(cls, *columns) -> Select:
+        """Core-запрос колонок модели (и дополнительных columns после них) - без ORM-объектов
+        и identity map, строки превращаются в словари через converter()"""
+        return select(*cls.read_columns(), *columns)
+
+    @classmethod
+    async def read(cls, session: AsyncSession, stmt: Select) -> List[dict]:
+        """Выполняет запрос из select_fields() и возвращает словари"""
+        convert = cls.converter()
+        result = await session.execute(stmt)
+        return [convert(row) for row in result]
+
     @classmethod
     def get_manager(cls, name: str):
         return cls._decl_class_registry.get(name)
@@ -65,6 +106,28 @@ class Base(AsyncAttrs, DeclarativeBase):
         except MultipleResultsFound:
             raise ValueError("Найдено более одного объекта.")
 
+    @classmethod
+    async def load_related(cls, session: AsyncSession, rows: List[dict], *names: str) -> List[dict]:
+        """Подгружает в словари rows связи names (relationship модели): один запрос на связь
+        для всех строк сразу, как selectinload. Связь-список кладётся списком словарей, иначе - словарём или None"""
+        for name in names:
+            relationship = cls.__mapper__.relationships[name]
+            (local, remote), = relationship.local_remote_pairs
+            target = relationship.mapper.class_
+            keys = {row[local.key] for row in rows} - {None}
+            related = await target.read(session, target.select_fields().where(remote.in_(keys))) if keys else []
+            if relationship.uselist:
+                groups: dict = {}
+                for item in related:
+                    groups.setdefault(item[remote.key], []).append(item)
+                for row in rows:
+                    row[name] = groups.get(row[local.key], [])
+            else:
+                by_key = {item[remote.key]: item for item in related}
+                for row in rows:
+                    row[name] = by_key.get(row[local.key])
+        return rows
+
     @classmethod
     async def list(cls, session: AsyncSession, **kwargs) -> list:
         try:
@@ -78,9 +141,7 @@ class Base(AsyncAttrs, DeclarativeBase):
     @classmethod
     async def list_dict(cls, session: AsyncSession, **kwargs) -> List[dict]:
         # try:
-        stmt = select(*cls.__table__.columns).filter_by(**kwargs)
-        result = await session.execute(stmt)
-        return [dict(note) for note in result.mappings().all()]
+        return await cls.read(session, cls.select_fields().filter_by(**kwargs))
         # except Exception as ex:
         #     logger.error(f"Ошибка в {cls.__name__}.list_dict: {ex}", exc_info=True)
         #     return []
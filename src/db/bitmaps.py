@@ -0,0 +1,117 @@
+"""Инвертированный индекс: вид деятельности -> битовая карта организаций"""
+from collections.abc import Iterable
+from uuid import UUID
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .memory import MemoryIndex
+from .models import Organization, OrganizationActivity
+
+
+def _bitmap(ordinals: Iterable[int], size: int) -> int:
+    """Битовая карта из номеров: биты ставятся в bytearray, число собирается одним преобразованием"""
+    buffer = bytearray((size + 7) // 8)
+    for ordinal in ordinals:
+        buffer[ordinal >> 3] |= 1 << (ordinal & 7)
+    return int.from_bytes(buffer, "little")
+
+
+class ActivityBitmapIndex(MemoryIndex):
+    """Каждой организации выдаётся порядковый номер (бит), виду деятельности - битовая карта
+    его организаций в виде int. Пересечение, объединение и исключение - побитовые &, |, & ~
+    над целыми числами без перебора строк. Номера удалённых организаций переиспользуются."""
+    keys = {Organization: "id", OrganizationActivity: "organization_id"}
+
+    def __init__(self):
+        super().__init__()
+        self._ordinals: dict[UUID, int] = {}
+        self._ids: list[UUID | None] = []  # номер -> id организации
+        self._free: list[int] = []
+        self._activities: dict[UUID, frozenset[UUID]] = {}  # организация -> её виды деятельности
+        self._bitmaps: dict[UUID, int] = {}
+        self._all = 0  # все организации
+
+    def _put(self, organization_id: UUID, activity_ids: Iterable[UUID]):
+        """Добавление одной организации при обновлении - каждая операция копирует карты целиком"""
+        if self._free:
+            ordinal = self._free.pop()
+            self._ids[ordinal] = organization_id
+        else:
+            ordinal = len(self._ids)
+            self._ids.append(organization_id)
+        self._ordinals[organization_id] = ordinal
+        self._activities[organization_id] = frozenset(activity_ids)
+        bit = 1 << ordinal
+        self._all |= bit
+        for activity_id in self._activities[organization_id]:
+            self._bitmaps[activity_id] = self._bitmaps.get(activity_id, 0) | bit
+
+    def _remove(self, organization_id: UUID):
+        if (ordinal := self._ordinals.pop(organization_id, None)) is None:
+            return
+        mask = ~(1 << ordinal)
+        self._all &= mask
+        for activity_id in self._activities.pop(organization_id):
+            if not (bitmap := self._bitmaps[activity_id] & mask):
+                del self._bitmaps[activity_id]
+            else:
+                self._bitmaps[activity_id] = bitmap
+        self._ids[ordinal] = None
+        self._free.append(ordinal)
+
+    async def _read(self, session: AsyncSession, ids: set[UUID] | None = None) -> dict[UUID, list[UUID]]:
+        organizations = select(Organization.id)
+        activities = select(OrganizationActivity.organization_id, OrganizationActivity.activity_id)
+        if ids is not None:
+            organizations = organizations.where(Organization.id.in_(ids))
+            activities = activities.where(OrganizationActivity.organization_id.in_(ids))
+        rows = {org_id: [] for org_id in (await session.execute(organizations)).scalars().all()}
+        for org_id, activity_id in (await session.execute(activities)).all():
+            if org_id in rows:
+                rows[org_id].append(activity_id)
+        return rows
+
+    async def load(self, session: AsyncSession):
+        # номера собираются по видам деятельности, и каждая карта строится один раз, а не через _put
+        rows = sorted((await self._read(session)).items())
+        self._ids = [org_id for org_id, _ in rows]
+        self._ordinals = {org_id: ordinal for ordinal, org_id in enumerate(self._ids)}
+        self._activities = {org_id: frozenset(activity_ids) for org_id, activity_ids in rows}
+        self._free = []
+        ordinals: dict[UUID, list[int]] = {}
+        for ordinal, org_id in enumerate(self._ids):
+            for activity_id in self._activities[org_id]:
+                ordinals.setdefault(activity_id, []).append(ordinal)
+        self._bitmaps = {activity_id: _bitmap(bits, len(self._ids)) for activity_id, bits in ordinals.items()}
+        self._all = (1 << len(self._ids)) - 1
+
+    async def refresh(self, session: AsyncSession, ids: set[UUID]):
+        rows = await self._read(session, ids)
+        for org_id in ids:
+            self._remove(org_id)
+        for org_id, activity_ids in rows.items():
+            self._put(org_id, activity_ids)
+
+    def bitmap(self, activity_ids: Iterable[UUID]) -> int:
+        """Организации хотя бы одного из видов деятельности"""
+        bitmap = 0
+        for activity_id in activity_ids:
+            bitmap |= self._bitmaps.get(activity_id, 0)
+        return bitmap
+
+    def query(self, all_of: Iterable[Iterable[UUID]] = (), any_of: Iterable[UUID] = (),
+              none_of: Iterable[UUID] = ()) -> list[UUID]:
+        """id организаций, у которых есть вид деятельности из каждой группы all_of,
+        хотя бы один из any_of (если он задан) и нет ни одного из none_of"""
+        bitmap = self._all
+        for group in all_of:
+            bitmap &= self.bitmap(group)
+        if any_of:
+            bitmap &= self.bitmap(any_of)
+        bitmap &= ~self.bitmap(none_of)
+        bits = bin(bitmap)[:1:-1]  # младший бит - первый символ
+        return [self._ids[ordinal] for ordinal, bit in enumerate(bits) if bit == "1"]
+
+
+activity_bitmaps = ActivityBitmapIndex()
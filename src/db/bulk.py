@@ -0,0 +1,24 @@
+"""Массовая запись строк в таблицу"""
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+BulkWriter = Callable[[list[dict]], Awaitable[Any]]
+
+
+async def bulk_writer(session: AsyncSession, model: type) -> BulkWriter:
+    """Запись пачки строк (все столбцы таблицы): бинарный COPY на asyncpg, на других драйверах - многострочный INSERT.
+    COPY идёт мимо событий ORM - после него нужен memory.mark_changed"""
+    connection = await session.connection()
+    if connection.dialect.driver != "asyncpg":
+        return lambda records: session.execute(insert(model), records)
+    driver = (await connection.get_raw_connection()).driver_connection  # та же транзакция, что у сессии
+    columns = [column.name for column in model.__table__.columns]
+
+    async def copy(records: list[dict]):
+        await driver.copy_records_to_table(model.__tablename__, columns=columns,
+                                           records=[tuple(record[column] for column in columns)
+                                                    for record in records])
+    return copy
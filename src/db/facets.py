@@ -0,0 +1,99 @@
+"""Счётчики организаций по поддеревьям видов деятельности"""
+from collections import Counter
+from collections.abc import Iterable
+from uuid import UUID
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.config import settings
+from .activities import ActivityTree, activity_tree
+from .memory import MemoryIndex
+from .models import Organization, OrganizationActivity
+
+
+class ActivityFacets(MemoryIndex):
+    """Для каждого здания: вид деятельности -> число организаций в его поддереве.
+    Организация засчитывается узлу, если хотя бы один её вид деятельности лежит в поддереве узла
+    (не глубже ACTIVITY_MAX_LEVEL) - так же, как её находит by_activity_tree.
+    Изменения организаций и их видов деятельности перечитываются точечно;
+    изменение самого дерева пересчитывает счётчики целиком."""
+    keys = {Organization: "id", OrganizationActivity: "organization_id"}
+
+    def __init__(self):
+        super().__init__()
+        self._organizations: dict[UUID, tuple[UUID, frozenset[UUID]]] = {}  # здание, засчитанные узлы
+        self._buildings: dict[UUID, Counter] = {}
+        self._total: Counter = Counter()
+        self._tree_version: int | None = None
+
+    @staticmethod
+    def _nodes(tree: ActivityTree, activity_ids: Iterable[UUID]) -> frozenset[UUID]:
+        nodes = set()
+        for activity_id in activity_ids:
+            if (node := tree.get(activity_id)) is not None and node.level <= settings.ACTIVITY_MAX_LEVEL:
+                nodes.update(tree.ancestors(activity_id))
+        return frozenset(nodes)
+
+    def _put(self, organization_id: UUID, building_id: UUID, nodes: frozenset[UUID]):
+        self._organizations[organization_id] = (building_id, nodes)
+        self._buildings.setdefault(building_id, Counter()).update(nodes)
+        self._total.update(nodes)
+
+    def _remove(self, organization_id: UUID):
+        if (organization := self._organizations.pop(organization_id, None)) is None:
+            return
+        building_id, nodes = organization
+        self._buildings[building_id].subtract(nodes)
+        self._total.subtract(nodes)
+        for counter in (self._buildings[building_id], self._total):
+            for node_id in nodes:
+                if counter[node_id] <= 0:
+                    del counter[node_id]
+        if not self._buildings[building_id]:
+            del self._buildings[building_id]
+
+    async def _read(self, session: AsyncSession, ids: set[UUID] | None = None) -> dict[UUID, tuple[UUID, list]]:
+        organizations = select(Organization.id, Organization.building_id)
+        activities = select(OrganizationActivity.organization_id, OrganizationActivity.activity_id)
+        if ids is not None:
+            organizations = organizations.where(Organization.id.in_(ids))
+            activities = activities.where(OrganizationActivity.organization_id.in_(ids))
+        rows = {org_id: (building_id, []) for org_id, building_id in (await session.execute(organizations)).all()}
+        for org_id, activity_id in (await session.execute(activities)).all():
+            if org_id in rows:
+                rows[org_id][1].append(activity_id)
+        return rows
+
+    async def load(self, session: AsyncSession):
+        tree = await activity_tree.ensure(session)
+        self._organizations, self._buildings, self._total = {}, {}, Counter()
+        for org_id, (building_id, activity_ids) in (await self._read(session)).items():
+            self._put(org_id, building_id, self._nodes(tree, activity_ids))
+        self._tree_version = tree.version
+
+    async def refresh(self, session: AsyncSession, ids: set[UUID]):
+        tree = await activity_tree.ensure(session)
+        rows = await self._read(session, ids)
+        for org_id in ids:
+            self._remove(org_id)
+        for org_id, (building_id, activity_ids) in rows.items():
+            self._put(org_id, building_id, self._nodes(tree, activity_ids))
+
+    async def ensure(self, session: AsyncSession) -> "ActivityFacets":
+        tree = await activity_tree.ensure(session)
+        if self._tree_version is not None and self._tree_version != tree.version:
+            self.invalidate()
+        return await super().ensure(session)
+
+    def counts(self, building_ids: Iterable[UUID] | None = None) -> Counter:
+        """Вид деятельности -> число организаций в поддереве, по всем зданиям или только по building_ids"""
+        if building_ids is None:
+            return self._total
+        counts = Counter()
+        for building_id in building_ids:
+            counts.update(self._buildings.get(building_id, {}))
+        return counts
+
+
+activity_facets = ActivityFacets()
@@ -0,0 +1,156 @@
+"""
+Журнал изменений, общий для воркеров.
+
+Каждый коммит, менявший строки таблиц, дописывает в файл journal строку JSON: изменённые таблицы
+и записи каждого индекса в памяти, которые устарели (значения keys индекса; null - индекс
+перечитывается целиком). Остальные процессы дочитывают журнал в начале каждого запроса
+(memory.sync_changes), помечают у себя те же записи устаревшими и меняют версии тех же таблиц.
+
+Строка дописывается в after_commit, до того как коммит вернёт управление обработчику,
+поэтому запрос, пришедший в любой воркер после ответа на запись, уже видит изменение.
+
+Позиция в журнале - (номер файла, смещение). Выросший больше MAX_SIZE журнал заменяется новым
+файлом со следующим номером; процесс, пропустивший целый файл, перезагружает все индексы.
+
+Журнал лежит в каталоге снимка (SNAPSHOT_DIR) и включается вместе с ним.
+"""
+import fcntl
+import json
+import os
+import uuid
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO
+from uuid import UUID
+
+from ..core.config import settings
+
+Position = tuple[int, int]  # номер файла журнала, смещение в нём
+
+MAX_SIZE = 1 << 20  # байт, после которых журнал начинается заново
+
+
+class ChangeJournal:
+    """Журнал изменений в каталоге directory (пустая строка - журнал выключен)"""
+
+    def __init__(self, directory: str):
+        self.path = Path(directory) / "journal" if directory else None
+        self.token = uuid.uuid4().hex  # метка строк этого процесса - их он не перечитывает
+        self._file: BinaryIO | None = None
+        self._number = 0
+        self._written: Position = (0, 0)  # конец последней своей строки
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Запись и замена файла журнала - по одному процессу; блокировка держится микросекунды"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path.with_suffix(".lock"), "wb") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _header(file: BinaryIO) -> int:
+        return json.loads(file.readline())["journal"]
+
+    def _start(self, number: int):
+        """Новый файл журнала (под блокировкой): процессы, читающие прежний, дочитают его по открытому файлу"""
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_bytes(json.dumps({"journal": number}).encode() + b"\n")
+        os.replace(tmp, self.path)
+
+    def _end(self) -> Position:
+        try:
+            with open(self.path, "rb") as file:
+                return self._header(file), os.fstat(file.fileno()).st_size
+        except (FileNotFoundError, ValueError, KeyError):
+            return 0, MAX_SIZE + 1
+
+    def open(self):
+        """Читать журнал с текущего конца - всё записанное раньше уже видно в БД.
+        Вызывается до первой загрузки индексов процесса; повторный вызов ничего не делает"""
+        if not self.enabled or self._file is not None:
+            return
+        with self._locked():
+            number, size = self._end()
+            if size > MAX_SIZE:
+                number += 1
+                self._start(number)
+            self._file = open(self.path, "rb")
+        self._number = self._header(self._file)
+        self._file.seek(0, os.SEEK_END)
+
+    @property
+    def position(self) -> Position:
+        """До какой позиции этому процессу известны изменения - прочитанные и свои"""
+        read = (self._number, self._file.tell()) if self._file is not None else (0, 0)
+        return max(read, self._written)
+
+    def end(self) -> Position:
+        """Текущий конец журнала: изменения до него уже закоммичены"""
+        with self._locked():
+            return self._end()
+
+    def append(self, tables: list[str], changes: dict[str, list[str] | None]):
+        """Записать изменения коммита: таблицы и устаревшие записи индексов (по имени класса индекса)"""
+        line = json.dumps({"token": self.token, "tables": tables, "changes": changes}).encode() + b"\n"
+        with self._locked():
+            number, size = self._end()
+            if size > MAX_SIZE:
+                number += 1
+                self._start(number)
+            with open(self.path, "ab") as file:
+                file.write(line)
+                self._written = max(self._written, (number, file.tell()))
+
+    def read(self) -> list[dict] | None:
+        """Строки других процессов после прочитанной позиции.
+        None - журнал сменился больше одного раза и часть изменений пропущена"""
+        if self._file is None:
+            return []
+        entries, missed = [], False
+        while True:
+            try:  # до дочитывания: после замены в прежний файл уже никто не пишет
+                replaced = os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino
+            except FileNotFoundError:
+                replaced = False
+            while (line := self._file.readline()).endswith(b"\n"):
+                if (entry := json.loads(line)).get("token") != self.token:
+                    entries.append(entry)
+            if line:  # строка дописывается прямо сейчас - дочитаем в следующий раз
+                self._file.seek(-len(line), os.SEEK_CUR)
+            if not replaced:
+                return None if missed else entries
+            file = open(self.path, "rb")
+            number = self._header(file)
+            missed = missed or number != self._number + 1
+            self._file.close()
+            self._file, self._number = file, number
+
+    def changes(self, start: Position, end: Position, name: str) -> set[UUID] | None:
+        """Записи индекса name, изменённые всеми процессами между позициями start и end.
+        None - индекс менялся целиком или строк уже нет (журнал сменился)"""
+        if start[0] != end[0]:
+            return None
+        with open(self.path, "rb") as file:
+            if self._header(file) != start[0]:
+                return None
+            file.seek(start[1])
+            ids: set[UUID] = set()
+            while file.tell() < end[1] and (line := file.readline()).endswith(b"\n"):
+                changed = json.loads(line)["changes"]
+                if name in changed:
+                    if changed[name] is None:
+                        return None
+                    ids.update(map(UUID, changed[name]))
+            return ids
+
+
+journal = ChangeJournal(settings.SNAPSHOT_DIR)
@@ -0,0 +1,186 @@
+"""
+Индексы в памяти процесса поверх таблиц БД.
+
+Индекс загружается из БД при первом обращении (ensure) и помечается устаревшим
+после коммита, в котором менялись строки отслеживаемых им таблиц. При следующем
+обращении перечитываются только изменённые записи; если их не удалось определить
+(Core-запросы insert/update/delete) — индекс перезагружается целиком.
+
+Индексы живут в памяти одного процесса. Изменения, прошедшие через сессии других
+процессов, они видят только через общий журнал (journal.py, включается с SNAPSHOT_DIR):
+коммит записывает в него то же, что помечает у себя, а sync_changes в начале запроса
+применяет строки других процессов. Без журнала индексы и версии верны только при одном воркере.
+
+Те же события ведут версии таблиц (table_versions): номер растёт после каждого коммита,
+менявшего строки таблицы, - по ним строятся ETag ответов и проверяются записи кэша ответов.
+"""
+import asyncio
+import logging
+from collections.abc import Iterable
+from typing import ClassVar
+from uuid import UUID
+
+from sqlalchemy import event, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .journal import journal
+
+logger = logging.getLogger(__name__)
+
+_indexes: list["MemoryIndex"] = []
+_CHANGES = "memory_index_changes"
+_TABLES = "memory_index_tables"
+_versions: dict[str, int] = {}
+_epoch = 0  # растёт, когда неизвестно, что изменили другие процессы
+
+
+def table_versions(*tables: str) -> tuple[int, ...]:
+    """Версии таблиц в этом процессе; первым идёт номер внешнего изменения"""
+    return _epoch, *(_versions.get(table, 0) for table in tables)
+
+
+def invalidate_all():
+    """Неизвестно, что изменили другие процессы: все индексы перезагружаются целиком, версии всех таблиц меняются"""
+    global _epoch
+    _epoch += 1
+    for index in _indexes:
+        index.invalidate()
+
+
+class MemoryIndex:
+    """Базовый класс индекса в памяти"""
+    # модель -> атрибут изменённой строки, по которому индекс перечитывает данные
+    keys: ClassVar[dict[type, str]] = {}
+
+    def __init__(self):
+        self.version = 0  # растёт при каждой (пере)загрузке
+        self._loaded = False
+        self._pending: set[UUID] | None = set()  # None - перезагрузить целиком
+        self._lock = asyncio.Lock()
+        _indexes.append(self)
+
+    async def load(self, session: AsyncSession):
+        """Полная загрузка индекса из БД"""
+        raise NotImplementedError
+
+    async def refresh(self, session: AsyncSession, ids: set[UUID]):
+        """Перечитать изменённые записи. По умолчанию - полная перезагрузка"""
+        await self.load(session)
+
+    def invalidate(self, ids: Iterable[UUID] | None = None):
+        """Пометить записи (или весь индекс, если ids=None) устаревшими"""
+        if ids is None or self._pending is None:
+            self._pending = None
+        else:
+            self._pending.update(ids)
+
+    @property
+    def is_fresh(self) -> bool:
+        return self._loaded and self._pending == set()
+
+    async def ensure(self, session: AsyncSession) -> "MemoryIndex":
+        """Актуализирует индекс и возвращает его"""
+        if self.is_fresh:
+            return self
+        async with self._lock:
+            if self.is_fresh:
+                return self
+            pending, self._pending = self._pending, set()
+            try:
+                if not self._loaded or pending is None:
+                    journal.open()  # изменения других процессов отсчитываются от первой загрузки
+                    await self.load(session)
+                else:
+                    await self.refresh(session, pending)
+            except Exception:
+                self.invalidate(pending)
+                raise
+            self._loaded = True
+            self.version += 1
+            logger.debug(f"{type(self).__name__} обновлён до версии {self.version}")
+        return self
+
+
+def _record(session: Session, index: MemoryIndex, value: UUID | None):
+    changes = session.info.setdefault(_CHANGES, {})
+    ids = changes.get(index, set())
+    if value is None or ids is None:
+        changes[index] = None
+    else:
+        ids.add(value)
+        changes[index] = ids
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_flush(session: Session, _flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        state = inspect(obj)
+        session.info.setdefault(_TABLES, set()).add(state.mapper.local_table.name)
+        for index in _indexes:
+            if attr := index.keys.get(type(obj)):
+                # и новое, и прежнее значение: строка могла переехать к другому ключу
+                for value in {state.dict.get(attr), *state.attrs[attr].history.deleted}:
+                    _record(session, index, value)
+
+
+def mark_changed(session: Session, *tables: str, keys: Iterable[UUID] | None = None):
+    """Строки таблиц изменены без ORM-объектов (Core-запрос, COPY). keys - значения атрибута,
+    по которому индексы следят за этими таблицами (keys индекса); без них индексы перезагрузятся целиком"""
+    session.info.setdefault(_TABLES, set()).update(tables)
+    for index in _indexes:
+        if any(model.__tablename__ in tables for model in index.keys):
+            for key in (None,) if keys is None else keys:
+                _record(session, index, key)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_statement(state):
+    if not (state.is_insert or state.is_update or state.is_delete):
+        return
+    if (table := getattr(getattr(state.statement, "table", None), "name", None)) is not None:
+        mark_changed(state.session, table)
+
+
+def _apply(tables: Iterable[str], changes: dict[MemoryIndex, set[UUID] | None]):
+    for index, ids in changes.items():
+        index.invalidate(ids)
+    for table in tables:
+        _versions[table] = _versions.get(table, 0) + 1
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_changes(session: Session):
+    changes, tables = session.info.pop(_CHANGES, {}), session.info.pop(_TABLES, set())
+    if tables and journal.enabled:
+        try:  # до пометки своих индексов: их обновление сверяется с позицией журнала (snapshot.py)
+            journal.append(sorted(tables), {
+                type(index).__name__: None if ids is None else sorted(map(str, ids))
+                for index, ids in changes.items()
+            })
+        except OSError:
+            logger.exception("Не удалось записать изменения в журнал - другие воркеры их не увидят")
+    _apply(tables, changes)
+
+
+async def sync_changes():
+    """Применить изменения других процессов из журнала. Зависимость маршрутов:
+    выполняется в цикле событий до проверки ETag и кэша; без журнала ничего не делает"""
+    if not journal.enabled:
+        return
+    if (entries := journal.read()) is None:
+        logger.warning("Часть журнала изменений пропущена - индексы перезагружаются целиком")
+        invalidate_all()
+        return
+    by_name = {type(index).__name__: index for index in _indexes}
+    for entry in entries:
+        _apply(entry["tables"], {
+            by_name[name]: None if ids is None else set(map(UUID, ids))
+            for name, ids in entry["changes"].items() if name in by_name
+        })
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_changes(session: Session):
+    session.info.pop(_CHANGES, None)
+    session.info.pop(_TABLES, None)
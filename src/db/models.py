@@ -3,26 +3,57 @@ from typing import Any, Optional as O
 from uuid import UUID
 
 import sqlalchemy as sa
-from sqlalchemy import DateTime, ForeignKey as FK, Text, Float
+from sqlalchemy import DateTime, ForeignKey as FK, Text, Float, event
 from sqlalchemy.orm import Mapped as M
 from sqlalchemy.orm import mapped_column as col
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import object_session, relationship
+from uuid6 import uuid7
 
 from .base import Base
+from ..core import geo
+from ..core.search import normalize
 from ..core.error import E
 
 
+def _building_geohash(context) -> str:
+    return Building.computed(context.get_current_parameters())["geohash"]
+
+
 class Building(Base):
     __tablename__ = "building"
 
     address: M[str] = col(Text, nullable=False, comment="Адрес здания")
     latitude: M[float] = col(Float, nullable=False, comment="Широта")
     longitude: M[float] = col(Float, nullable=False, comment="Долгота")
+    geohash: M[str] = col(Text(collation="C"), nullable=False, index=True, default=_building_geohash,
+                          comment="Geohash координат")
     created_at: M[datetime] = col(DateTime(timezone=True), default=datetime.now(UTC), comment="Дата создания")
 
-    organizations: M[Any] = relationship("Organization", back_populates="building")
+    organizations: M[list["Organization"]] = relationship("Organization", back_populates="building")
 
     er_404 = E.ER_NOT_BUILDING
+    _exclude = ("geohash",)
+
+    @classmethod
+    def computed(cls, values: dict) -> dict:
+        return {"geohash": geo.geohash(values["latitude"], values["longitude"])}
+
+    @classmethod
+    def in_box(cls, lat_min: float, lat_max: float, lon_min: float, lon_max: float):
+        """Условие попадания в прямоугольник: диапазоны geohash по индексу + точная проверка координат"""
+        return sa.and_(
+            sa.or_(sa.false(), *[
+                sa.and_(cls.geohash >= prefix, cls.geohash < prefix + "{")  # "{" идёт сразу после "z"
+                for prefix in geo.geohash_cover(lat_min, lat_max, lon_min, lon_max)
+            ]),
+            cls.latitude.between(lat_min, lat_max),
+            cls.longitude.between(lon_min, lon_max),
+        )
+
+
+@event.listens_for(Building, "before_update")
+def _update_geohash(_mapper, _connection, target: Building):
+    target.geohash = geo.geohash(target.latitude, target.longitude)
 
 
 class Activity(Base):
@@ -31,25 +62,85 @@ class Activity(Base):
     name: M[str] = col(Text, nullable=False, comment="Название деятельности")
     parent_id: M[O[UUID]] = col(FK("activity.id", ondelete="CASCADE"), nullable=True, comment="Родительская деятельность")
     level: M[int] = col(sa.Integer, nullable=False, default=1, comment="Уровень вложенности (1-3)")
+    path: M[str] = col(Text(collation="C"), nullable=False, index=True,
+                       comment="Материализованный путь: /id корня/.../id/")
     created_at: M[datetime] = col(DateTime(timezone=True), default=datetime.now(UTC), comment="Дата создания")
 
-    organizations: M[Any] = relationship("OrganizationActivity", back_populates="activity")
+    organizations: M[list["OrganizationActivity"]] = relationship("OrganizationActivity", back_populates="activity")
 
     er_404 = E.ER_NOT_ACTIVITY
+    _exclude = ("path",)
+
+
+def _activity_path(connection, activity: Activity) -> str:
+    if activity.parent_id is None:
+        return f"/{activity.id}/"
+    # родитель может вставляться в этом же flush
+    pending = {obj.id: obj for obj in object_session(activity).new if isinstance(obj, Activity)}
+    if parent := pending.get(activity.parent_id):
+        parent_path = parent.path or _activity_path(connection, parent)
+    else:
+        parent_path = connection.scalar(sa.select(Activity.path).where(Activity.id == activity.parent_id))
+    return f"{parent_path}{activity.id}/"
+
+
+@event.listens_for(Activity, "before_insert")
+def _insert_activity_path(_mapper, connection, target: Activity):
+    if target.id is None:
+        target.id = uuid7()
+    target.path = _activity_path(connection, target)
+
+
+@event.listens_for(Activity, "before_update")
+def _update_activity_path(_mapper, connection, target: Activity):
+    if not sa.inspect(target).attrs.parent_id.history.has_changes():
+        return
+    old_path, target.path = target.path, _activity_path(connection, target)
+    # переносим всё поддерево
+    path = Activity.__table__.c.path
+    connection.execute(
+        sa.update(Activity.__table__)
+        .where(path > old_path, path < old_path + "~")
+        .values(path=sa.literal(target.path, Text) + sa.func.substr(path, len(old_path) + 1))
+    )
+
+
+def _organization_search_name(context) -> str:
+    return Organization.computed(context.get_current_parameters())["search_name"]
 
 
 class Organization(Base):
     __tablename__ = "organization"
+    __table_args__ = (
+        # триграммный индекс: LIKE '%...%' и нечёткое сравнение (<%) без полного просмотра таблицы
+        sa.Index("ix_organization_search_name", "search_name",
+                 postgresql_using="gin", postgresql_ops={"search_name": "gin_trgm_ops"}),
+    )
 
     name: M[str] = col(Text, nullable=False, comment="Название организации")
-    building_id: M[UUID] = col(FK("building.id", ondelete="RESTRICT"), nullable=False, comment="Здание")
+    search_name: M[str] = col(Text, nullable=False, default=_organization_search_name,
+                              comment="Название для поиска: нижний регистр, ё -> е, без знаков препинания")
+    building_id: M[UUID] = col(FK("building.id", ondelete="RESTRICT"), nullable=False, index=True, comment="Здание")
     created_at: M[datetime] = col(DateTime(timezone=True), default=datetime.now(UTC), comment="Дата создания")
 
     building: M[Any] = relationship("Building", back_populates="organizations")
-    phone_numbers: M[Any] = relationship("OrganizationPhone", back_populates="organization")
-    activities: M[Any] = relationship("OrganizationActivity", back_populates="organization")
+    # связи удаляет сама БД (ondelete="CASCADE") - ORM не загружает их при удалении организации
+    phone_numbers: M[list["OrganizationPhone"]] = relationship("OrganizationPhone", back_populates="organization",
+                                                               passive_deletes=True)
+    activities: M[list["OrganizationActivity"]] = relationship("OrganizationActivity", back_populates="organization",
+                                                               passive_deletes=True)
 
     er_404 = E.ER_NOT_ORGANIZATION
+    _exclude = ("search_name",)
+
+    @classmethod
+    def computed(cls, values: dict) -> dict:
+        return {"search_name": normalize(values["name"])}
+
+
+@event.listens_for(Organization, "before_update")
+def _update_search_name(_mapper, _connection, target: Organization):
+    target.search_name = normalize(target.name)
 
 
 class OrganizationPhone(Base):
@@ -67,8 +158,10 @@ class OrganizationPhone(Base):
 class OrganizationActivity(Base):
     __tablename__ = "organization_activity"
 
-    organization_id: M[UUID] = col(FK("organization.id", ondelete="CASCADE"), nullable=False, comment="Организация")
-    activity_id: M[UUID] = col(FK("activity.id", ondelete="RESTRICT"), nullable=False, comment="Деятельность")
+    organization_id: M[UUID] = col(FK("organization.id", ondelete="CASCADE"), nullable=False, index=True,
+                                   comment="Организация")
+    activity_id: M[UUID] = col(FK("activity.id", ondelete="RESTRICT"), nullable=False, index=True,
+                               comment="Деятельность")
     created_at: M[datetime] = col(DateTime(timezone=True), default=datetime.now(UTC), comment="Дата создания")
 
     organization: M[Any] = relationship("Organization", back_populates="activities")
@@ -0,0 +1,96 @@
+"""Префиксный индекс названий организаций для автодополнения"""
+from bisect import bisect_left, insort
+from collections.abc import Iterator
+from uuid import UUID
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.search import normalize
+from .memory import MemoryIndex
+from .models import Organization
+
+Entry = tuple[str, UUID, str]  # ключ (нормализованное название или его хвост), id, название
+
+
+class NameIndex(MemoryIndex):
+    """Два отсортированных массива: нормализованные названия целиком и хвосты названий,
+    начиная со второго, третьего... слова. Названия с префиксом q лежат в каждом массиве подряд
+    с позиции bisect_left(q), поэтому ответ - два бинарных поиска и не больше limit шагов по массивам"""
+    keys = {Organization: "id"}
+
+    def __init__(self):
+        super().__init__()
+        self._full: list[Entry] = []
+        self._words: list[Entry] = []
+        self._names: dict[UUID, str] = {}
+
+    @staticmethod
+    def _keys(name: str) -> list[str]:
+        words = normalize(name).split()
+        return [" ".join(words[i:]) for i in range(len(words))] or [""]
+
+    def _put(self, organization_id: UUID, name: str):
+        self._names[organization_id] = name
+        full, *tails = self._keys(name)
+        insort(self._full, (full, organization_id, name))
+        for key in tails:
+            insort(self._words, (key, organization_id, name))
+
+    @staticmethod
+    def _discard(entries: list[Entry], entry: Entry):
+        i = bisect_left(entries, entry)
+        if i < len(entries) and entries[i] == entry:
+            del entries[i]
+
+    def _remove(self, organization_id: UUID):
+        if (name := self._names.pop(organization_id, None)) is None:
+            return
+        full, *tails = self._keys(name)
+        self._discard(self._full, (full, organization_id, name))
+        for key in tails:
+            self._discard(self._words, (key, organization_id, name))
+
+    async def load(self, session: AsyncSession):
+        result = await session.execute(select(Organization.id, Organization.name))
+        self._names, self._full, self._words = {}, [], []
+        for organization_id, name in result.all():
+            self._names[organization_id] = name
+            full, *tails = self._keys(name)
+            self._full.append((full, organization_id, name))
+            self._words.extend((key, organization_id, name) for key in tails)
+        self._full.sort()
+        self._words.sort()
+
+    async def refresh(self, session: AsyncSession, ids: set[UUID]):
+        result = await session.execute(select(Organization.id, Organization.name).where(Organization.id.in_(ids)))
+        for organization_id in ids:
+            self._remove(organization_id)
+        for organization_id, name in result.all():
+            self._put(organization_id, name)
+
+    @staticmethod
+    def _matches(entries: list[Entry], prefix: str) -> Iterator[Entry]:
+        for i in range(bisect_left(entries, (prefix,)), len(entries)):
+            if not entries[i][0].startswith(prefix):
+                return
+            yield entries[i]
+
+    def complete(self, q: str, limit: int = 10) -> list[dict]:
+        """До limit организаций с префиксом q: сначала те, чьё название начинается с q,
+        затем с q в начале другого слова; внутри - по алфавиту"""
+        if not (prefix := normalize(q)):
+            return []
+        found: dict[UUID, str] = {}
+        for _, organization_id, name in self._matches(self._full, prefix):
+            if len(found) == limit:
+                break
+            found[organization_id] = name
+        for _, organization_id, name in self._matches(self._words, prefix):
+            if len(found) == limit:
+                break
+            found.setdefault(organization_id, name)
+        return [{"id": organization_id, "name": name} for organization_id, name in found.items()]
+
+
+name_index = NameIndex()
@@ -1,9 +1,17 @@
 import json
 import asyncio
 import logging
+import re
+import time
 from datetime import datetime
+from collections.abc import Iterator
 from uuid import UUID
+
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+
+from .bulk import bulk_writer
+from .memory import mark_changed
 from .models import Building, Activity, Organization, OrganizationPhone, OrganizationActivity
 from src.core.config import settings
 
@@ -15,80 +23,179 @@ logger = logging.getLogger(__name__)
 if hasattr(asyncio, 'WindowsSelectorEventLoopPolicy'):
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
+BATCH = 1000  # строк в одном COPY / многострочном INSERT
+PROGRESS = 100_000  # строк между сообщениями о ходе загрузки таблицы
+_WHITESPACE = re.compile(r"\s*")
+
+
+def iter_json_tables(json_file_path: str, chunk_size: int = 1 << 16) -> Iterator[tuple[str, dict]]:
+    """Записи файла вида {"таблица": [{...}, ...], ...} по одной: (таблица, запись).
+    Файл читается кусками по chunk_size, в памяти - только текущий кусок и недочитанная запись"""
+    decoder = json.JSONDecoder()
+    with open(json_file_path, encoding='utf-8') as f:
+        buffer, pos, eof = "", 0, False
+
+        def fill() -> bool:
+            nonlocal buffer, pos, eof
+            chunk = f.read(chunk_size)
+            buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+            return bool(chunk)
+
+        def peek() -> str:
+            nonlocal pos
+            while (pos := _WHITESPACE.match(buffer, pos).end()) == len(buffer):
+                if not fill():
+                    raise ValueError("Unexpected end of fixtures file")
+            return buffer[pos]
+
+        def expect(chars: str) -> str:
+            nonlocal pos
+            if (char := peek()) not in chars:
+                raise ValueError(f"Expected one of {chars!r}, got {char!r}")
+            pos += 1
+            return char
+
+        def value():
+            nonlocal pos
+            peek()
+            while True:
+                try:
+                    obj, end = decoder.raw_decode(buffer, pos)
+                    if end < len(buffer) or eof:  # число могло оборваться на границе куска
+                        pos = end
+                        return obj
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill()
+
+        expect("{")
+        if peek() == "}":
+            return
+        while True:
+            table = value()
+            expect(":")
+            expect("[")
+            if peek() == "]":
+                pos += 1
+            else:
+                while True:
+                    yield table, value()
+                    if expect(",]") == "]":
+                        break
+            if expect(",}") == "}":
+                return
+
+
+class _Fixtures:
+    """Преобразование записей фикстур в строки таблиц (Model.record); путь вида деятельности
+    строится от пути родителя, поэтому родитель должен идти в файле раньше детей"""
+
+    def __init__(self):
+        self.paths: dict[UUID, str] = {}  # путь каждого загруженного вида деятельности - для его детей
+
+    @staticmethod
+    def buildings(data: dict) -> dict:
+        return Building.record(datetime.fromisoformat(data['created_at']), id=UUID(data['id']),
+                               address=data['address'], latitude=data['latitude'], longitude=data['longitude'])
+
+    def activities(self, data: dict) -> dict:
+        activity_id = UUID(data['id'])
+        parent_id = UUID(data['parent_id']) if data['parent_id'] else None
+        if parent_id is not None and parent_id not in self.paths:
+            raise ValueError(f"Activity {activity_id} goes before its parent {parent_id}")
+        self.paths[activity_id] = f"{self.paths[parent_id] if parent_id else '/'}{activity_id}/"
+        return Activity.record(datetime.fromisoformat(data['created_at']), id=activity_id, name=data['name'],
+                               parent_id=parent_id, level=data['level'], path=self.paths[activity_id])
+
+    @staticmethod
+    def organizations(data: dict) -> dict:
+        return Organization.record(datetime.fromisoformat(data['created_at']), id=UUID(data['id']),
+                                   name=data['name'], building_id=UUID(data['building_id']))
+
+    @staticmethod
+    def organization_phones(data: dict) -> dict:
+        return OrganizationPhone.record(datetime.fromisoformat(data['created_at']),
+                                        organization_id=UUID(data['organization_id']),
+                                        phone_number=data['phone_number'])
+
+    @staticmethod
+    def organization_activities(data: dict) -> dict:
+        return OrganizationActivity.record(datetime.fromisoformat(data['created_at']),
+                                           organization_id=UUID(data['organization_id']),
+                                           activity_id=UUID(data['activity_id']))
+
+
+# таблицы фикстур в порядке загрузки (внешние ключи) - в этом же порядке они должны идти в файле
+FIXTURE_TABLES = {
+    'buildings': Building,
+    'activities': Activity,
+    'organizations': Organization,
+    'organization_phones': OrganizationPhone,
+    'organization_activities': OrganizationActivity,
+}
+
+
+async def _clear(session: AsyncSession):
+    tables = [model.__tablename__ for model in reversed(FIXTURE_TABLES.values())]
+    if (await session.connection()).dialect.name == "postgresql":
+        await session.execute(text(f"TRUNCATE {', '.join(tables)}"))
+    else:
+        for model in reversed(FIXTURE_TABLES.values()):
+            await session.execute(model.__table__.delete())
+
+
 async def load_json_fixtures(session: AsyncSession, json_file_path: str):
+    """Загрузка фикстур одной транзакцией: TRUNCATE всех таблиц, затем записи файла по мере чтения
+    пачками по BATCH (COPY на asyncpg, иначе многострочный INSERT)"""
+    started = time.perf_counter()
+    fixtures = _Fixtures()
+    pending = list(FIXTURE_TABLES)  # таблицы, которые ещё могут встретиться в файле
+    batch: list[dict] = []
+    table, write, convert = None, None, None
+    count, table_started = 0, started
+
+    async def finish_table():
+        if batch:
+            await write(batch)
+            batch.clear()
+        seconds = time.perf_counter() - table_started
+        logger.info(f"{table.replace('_', ' ').capitalize()} loaded: {count} rows "
+                    f"in {seconds:.2f} s ({count / seconds if seconds else 0:.0f} rows/s).")
+
     try:
-        for table in [OrganizationActivity, OrganizationPhone, Organization, Activity, Building]:
-            await session.execute(table.__table__.delete())
-        await session.commit()
+        await _clear(session)
         logger.info("Existing data cleared.")
 
-        with open(json_file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-
-        for building_data in data.get('buildings', []):
-            building = Building(
-                id=UUID(building_data['id']),
-                address=building_data['address'],
-                latitude=building_data['latitude'],
-                longitude=building_data['longitude'],
-                created_at=datetime.fromisoformat(building_data['created_at']),
-            )
-            session.add(building)
-        await session.flush()
-        logger.info("Buildings loaded.")
-
-        # Load Activities
-        for activity_data in data.get('activities', []):
-            activity = Activity(
-                id=UUID(activity_data['id']),
-                name=activity_data['name'],
-                parent_id=UUID(activity_data['parent_id']) if activity_data['parent_id'] else None,
-                level=activity_data['level'],
-                created_at=datetime.fromisoformat(activity_data['created_at']),
-            )
-            session.add(activity)
-        await session.flush()
-        logger.info("Activities loaded.")
-
-        for org_data in data.get('organizations', []):
-            organization = Organization(
-                id=UUID(org_data['id']),
-                name=org_data['name'],
-                building_id=UUID(org_data['building_id']),
-                created_at=datetime.fromisoformat(org_data['created_at']),
-            )
-            session.add(organization)
-        await session.flush()
-        logger.info("Organizations loaded.")
-
-        # Load Organization Phones
-        for phone_data in data.get('organization_phones', []):
-            phone = OrganizationPhone(
-                organization_id=UUID(phone_data['organization_id']),
-                phone_number=phone_data['phone_number'],
-                created_at=datetime.fromisoformat(phone_data['created_at']),
-            )
-            session.add(phone)
-        await session.flush()
-        logger.info("Organization phones loaded.")
-
-        for org_activity_data in data.get('organization_activities', []):
-            org_activity = OrganizationActivity(
-                organization_id=UUID(org_activity_data['organization_id']),
-                activity_id=UUID(org_activity_data['activity_id']),
-                created_at=datetime.fromisoformat(org_activity_data['created_at']),
-            )
-            session.add(org_activity)
-        await session.flush()
-        logger.info("Organization activities loaded.")
+        for name, data in iter_json_tables(json_file_path):
+            if name != table:
+                if table is not None:
+                    await finish_table()
+                if name not in pending:
+                    raise ValueError(f"Unknown or out-of-order fixtures table: {name}")
+                del pending[:pending.index(name) + 1]
+                table, count, table_started = name, 0, time.perf_counter()
+                write = await bulk_writer(session, FIXTURE_TABLES[name])
+                convert = getattr(fixtures, name)
+            batch.append(convert(data))
+            count += 1
+            if len(batch) >= BATCH:
+                await write(batch)
+                batch.clear()
+            if count % PROGRESS == 0:
+                logger.info(f"{table}: {count} rows...")
+        if table is not None:
+            await finish_table()
 
+        mark_changed(session.sync_session, *(model.__tablename__ for model in FIXTURE_TABLES.values()))
         await session.commit()
-        logger.info("JSON fixtures loaded successfully.")
+        logger.info(f"JSON fixtures loaded successfully in {time.perf_counter() - started:.2f} s.")
     except Exception as e:
         logger.error(f"Error loading fixtures: {str(e)}")
         await session.rollback()
         raise
 
+
 async def run_fixtures(session: AsyncSession, json_file_path: str = "static/fixtures.json"):
     """Run the JSON fixture loading process."""
     await load_json_fixtures(session, json_file_path)
@@ -15,7 +15,12 @@ url = (f"{s.POSTGRES_USER}:{s.POSTGRES_PASSWORD}@"
 
 DATABASE_URL_ASYNC = f"postgresql+asyncpg://{url}"
 
-engine = create_async_engine(DATABASE_URL_ASYNC, echo=True)
+engine = create_async_engine(
+    DATABASE_URL_ASYNC,
+    echo=True,
+    # порог оператора <% (нечёткий поиск по названию) - задаётся на соединение, чтобы запрос шёл по индексу
+    connect_args={"server_settings": {"pg_trgm.word_similarity_threshold": str(s.NAME_SIMILARITY_THRESHOLD)}},
+)
 AsyncSessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
@@ -0,0 +1,555 @@
+"""
+Общий для воркеров снимок справочных данных.
+
+Дерево видов деятельности, координаты зданий (разложенные по ячейкам сетки), здание каждой
+организации и суммы тайлов карты записываются в компактный файл, который процессы отображают
+в память только на чтение (mmap). Индексы spatial.py, tiles.py и activities.py при включённом
+снимке не копируют его в объекты Python, а читают разделы файла через представления ниже:
+поиск по id и по ячейке - двоичный поиск прямо по отображению. Страницы файла общие у всех
+воркеров, поэтому память под эти данные от числа воркеров не зависит.
+
+Снимки пронумерованы поколениями. Новое поколение пишется в отдельный файл,
+затем атомарно подменяется указатель current - читатели видят либо старое, либо
+новое поколение целиком. Поколение помнит позицию журнала изменений (journal.py),
+до которой оно собрано: о коммитах узнают из журнала все процессы, и следующее поколение
+публикует тот, кто первым его запросит, - остальные подключаются к готовому.
+
+Снимок включается настройкой SNAPSHOT_DIR; без неё каждый процесс читает БД сам.
+"""
+import asyncio
+import fcntl
+import logging
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from collections.abc import AsyncIterator, Callable, Iterator
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import NamedTuple
+from uuid import UUID
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.config import settings
+from ..core.geo import MAX_ZOOM, TILE_CELL_BITS, grid_cell, mercator_cell
+from .journal import Position, journal
+from .memory import MemoryIndex
+from .models import Activity, Building, Organization
+from .session import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"ORGSNAP3"
+# магия, поколение, позиция журнала (номер файла, смещение), метка запуска мастера, число зданий,
+# организаций, видов деятельности, длина названий и путей в байтах, число ячеек сетки и ячеек тайлов
+_HEADER = struct.Struct("=8sQQQ32s7I")
+_POINTER = "current"
+TILE_LEVELS = MAX_ZOOM + TILE_CELL_BITS + 1  # уровни сумм тайлов: 0..MAX_ZOOM + TILE_CELL_BITS
+
+ActivityRow = tuple[UUID, str, UUID | None, int, str]  # id, название, родитель, уровень, путь
+
+
+class _Layout(NamedTuple):
+    """Смещения разделов файла; каждый раздел выровнен на 8 байт"""
+    building_ids: slice  # по ячейкам сетки, в ячейке - по id
+    latitudes: slice
+    longitudes: slice
+    building_order: slice  # номера зданий по возрастанию id
+    grid_keys: slice  # ключи непустых ячеек сетки по возрастанию
+    grid_starts: slice  # номер первого здания ячейки
+    organization_ids: slice
+    organization_buildings: slice  # номер здания организации в building_ids
+    activity_ids: slice  # в порядке путей
+    activity_order: slice  # номера видов деятельности по возрастанию id
+    activity_parents: slice  # номер родителя, -1 у корня
+    activity_levels: slice
+    name_offsets: slice
+    path_offsets: slice
+    tile_keys: slice  # ключи непустых ячеек тайлов всех уровней по возрастанию
+    tile_counts: slice  # число организаций в ячейке
+    tile_latitudes: slice  # сумма широт организаций ячейки
+    tile_longitudes: slice
+    names: slice
+    paths: slice
+
+    @classmethod
+    def of(cls, buildings: int, organizations: int, activities: int, names: int, paths: int,
+           cells: int, tiles: int) -> "_Layout":
+        sizes = (16 * buildings, 8 * buildings, 8 * buildings, 4 * buildings, 8 * cells, 4 * (cells + 1),
+                 16 * organizations, 4 * organizations,
+                 16 * activities, 4 * activities, 4 * activities, 4 * activities, 4 * (activities + 1),
+                 4 * (activities + 1), 8 * tiles, 4 * tiles, 8 * tiles, 8 * tiles, names, paths)
+        sections, offset = [], _HEADER.size + -_HEADER.size % 8
+        for size in sizes:
+            sections.append(slice(offset, offset + size))
+            offset += size + -size % 8
+        return cls(*sections)
+
+
+def _grid_key(i: int, j: int) -> int:
+    """Ключ ячейки сетки: порядок ключей совпадает с порядком пар (i, j)"""
+    return (i + (1 << 31)) << 32 | (j + (1 << 31))
+
+
+def _tile_key(level: int, x: int, y: int) -> int:
+    return level << 42 | x << 21 | y
+
+
+def _parent_token() -> bytes:
+    """Метка мастера uvicorn/gunicorn: pid родителя и время его запуска - общие у воркеров одного запуска"""
+    ppid = os.getppid()
+    try:
+        with open(f"/proc/{ppid}/stat", "rb") as file:
+            started = file.read().rsplit(b")", 1)[1].split()[19].decode()
+    except (OSError, IndexError):
+        started = "?"
+    return f"{ppid}:{started}".encode()[:32].ljust(32, b"\0")
+
+
+class _Ids:
+    """UUID раздела как последовательность bytes, упорядоченная по order (номера строк раздела;
+    без него - в порядке раздела), - для bisect без копирования раздела"""
+
+    def __init__(self, view: memoryview, order: memoryview | None = None):
+        self._view, self._order = view, order
+
+    def __len__(self) -> int:
+        return len(self._view) // 16
+
+    def __getitem__(self, k: int) -> bytes:
+        i = self._order[k] if self._order is not None else k
+        return self._view[16 * i:16 * i + 16].tobytes()
+
+    def row(self, value: UUID | None) -> int | None:
+        """Номер строки раздела с этим id (как dict.get, None для None)"""
+        if value is None:
+            return None
+        k = bisect_left(self, value.bytes)
+        if k == len(self) or self[k] != value.bytes:
+            return None
+        return self._order[k] if self._order is not None else k
+
+
+class Snapshot:
+    """Снимок одного поколения, отображённый в память только на чтение"""
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        magic, self.generation, number, offset, self.token, *counts = _HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError(f"{path} - не снимок")
+        self.position: Position = (number, offset)  # изменения до этой позиции журнала в снимке есть
+        layout = _Layout.of(*counts)
+        self.path = path
+        self._building_ids = view[layout.building_ids]
+        self._buildings = _Ids(self._building_ids, view[layout.building_order].cast("I"))
+        self._latitudes = view[layout.latitudes].cast("d")
+        self._longitudes = view[layout.longitudes].cast("d")
+        self._grid_keys = view[layout.grid_keys].cast("Q")
+        self._grid_starts = view[layout.grid_starts].cast("I")
+        self._organization_ids = _Ids(view[layout.organization_ids])
+        self._organization_buildings = view[layout.organization_buildings].cast("I")
+        self._activity_ids = view[layout.activity_ids]
+        self._activities = _Ids(self._activity_ids, view[layout.activity_order].cast("I"))
+        self._activity_parents = view[layout.activity_parents].cast("i")
+        self._activity_levels = view[layout.activity_levels].cast("I")
+        self._name_offsets = view[layout.name_offsets].cast("I")
+        self._path_offsets = view[layout.path_offsets].cast("I")
+        self._tile_keys = view[layout.tile_keys].cast("Q")
+        self._tile_counts = view[layout.tile_counts].cast("I")
+        self._tile_latitudes = view[layout.tile_latitudes].cast("d")
+        self._tile_longitudes = view[layout.tile_longitudes].cast("d")
+        self._names = view[layout.names]
+        self._paths = view[layout.paths]
+        self.points = _Points(self)
+        self.grid = _Grid(self)
+        self.tiles = _Tiles(self)
+        self.activity_ids = _ActivityIds(self)
+        self.activity_paths = _ActivityPaths(self)
+        self.activity_children = _ActivityChildren(self)
+
+    def _uuid(self, view: memoryview, i: int) -> UUID:
+        return UUID(bytes=view[16 * i:16 * i + 16].tobytes())
+
+    def _point(self, i: int) -> tuple[UUID, tuple[float, float]]:
+        return self._uuid(self._building_ids, i), (self._latitudes[i], self._longitudes[i])
+
+    def _path(self, i: int) -> str:
+        return self._paths[self._path_offsets[i]:self._path_offsets[i + 1]].tobytes().decode()
+
+    def _activity(self, i: int) -> ActivityRow:
+        names, parent = self._name_offsets, self._activity_parents[i]
+        return (
+            self._uuid(self._activity_ids, i),
+            self._names[names[i]:names[i + 1]].tobytes().decode(),
+            self._uuid(self._activity_ids, parent) if parent >= 0 else None,
+            self._activity_levels[i],
+            self._path(i),
+        )
+
+    def buildings(self) -> Iterator[tuple[UUID, float, float]]:
+        for i in range(len(self._latitudes)):
+            building_id, (latitude, longitude) = self._point(i)
+            yield building_id, latitude, longitude
+
+    def organizations(self) -> Iterator[tuple[UUID, UUID]]:
+        """Пары (организация, здание)"""
+        for i in range(len(self._organization_ids)):
+            yield (UUID(bytes=self._organization_ids[i]),
+                   self._uuid(self._building_ids, self._organization_buildings[i]))
+
+    def activities(self) -> Iterator[ActivityRow]:
+        """Виды деятельности в порядке путей"""
+        for i in range(len(self._activity_parents)):
+            yield self._activity(i)
+
+    def activity_nodes(self, factory: Callable[..., tuple]) -> "_ActivityNodes":
+        """Виды деятельности по id; узел строится factory из полей ActivityRow"""
+        return _ActivityNodes(self, factory)
+
+
+class _Points:
+    """Координаты зданий по id: {id здания: (широта, долгота)} поверх снимка"""
+
+    def __init__(self, snap: Snapshot):
+        self._snap = snap
+
+    def __len__(self) -> int:
+        return len(self._snap._latitudes)
+
+    def __getitem__(self, building_id: UUID) -> tuple[float, float]:
+        if (i := self._snap._buildings.row(building_id)) is None:
+            raise KeyError(building_id)
+        return self._snap._latitudes[i], self._snap._longitudes[i]
+
+
+class _Cell:
+    """Здания одной ячейки сетки: items() - пары (id здания, (широта, долгота))"""
+
+    def __init__(self, snap: Snapshot, start: int, stop: int):
+        self._snap, self._range = snap, range(start, stop)
+
+    def __len__(self) -> int:
+        return len(self._range)
+
+    def items(self) -> Iterator[tuple[UUID, tuple[float, float]]]:
+        return map(self._snap._point, self._range)
+
+
+class _Grid:
+    """Непустые ячейки сетки: {(i, j): здания ячейки} поверх снимка"""
+
+    def __init__(self, snap: Snapshot):
+        self._snap = snap
+
+    def __len__(self) -> int:
+        return len(self._snap._grid_keys)
+
+    def _cell(self, k: int) -> _Cell:
+        return _Cell(self._snap, self._snap._grid_starts[k], self._snap._grid_starts[k + 1])
+
+    def get(self, cell: tuple[int, int]) -> _Cell | None:
+        keys, key = self._snap._grid_keys, _grid_key(*cell)
+        k = bisect_left(keys, key)
+        return self._cell(k) if k < len(keys) and keys[k] == key else None
+
+    def items(self) -> Iterator[tuple[tuple[int, int], _Cell]]:
+        for k, key in enumerate(self._snap._grid_keys):
+            yield ((key >> 32) - (1 << 31), (key & 0xFFFFFFFF) - (1 << 31)), self._cell(k)
+
+
+class _Tiles:
+    """Ячейки тайлов: {(уровень, x, y): (число организаций, сумма широт, сумма долгот)} поверх снимка"""
+
+    def __init__(self, snap: Snapshot):
+        self._snap = snap
+
+    def get(self, cell: tuple[int, int, int]) -> tuple[int, float, float] | None:
+        snap, key = self._snap, _tile_key(*cell)
+        k = bisect_left(snap._tile_keys, key)
+        if k == len(snap._tile_keys) or snap._tile_keys[k] != key:
+            return None
+        return snap._tile_counts[k], snap._tile_latitudes[k], snap._tile_longitudes[k]
+
+
+class _ActivityNodes:
+    """Виды деятельности по id: {id: узел} поверх снимка"""
+
+    def __init__(self, snap: Snapshot, factory: Callable[..., tuple]):
+        self._snap, self._factory = snap, factory
+
+    def get(self, activity_id: UUID, default=None):
+        if (i := self._snap._activities.row(activity_id)) is None:
+            return default
+        return self._factory(*self._snap._activity(i))
+
+    def __getitem__(self, activity_id: UUID):
+        if (node := self.get(activity_id)) is None:
+            raise KeyError(activity_id)
+        return node
+
+
+class _ActivityIds:
+    """id видов деятельности в порядке путей: последовательность поверх снимка"""
+
+    def __init__(self, snap: Snapshot):
+        self._snap = snap
+
+    def __len__(self) -> int:
+        return len(self._snap._activity_parents)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(len(self)))]
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._snap._uuid(self._snap._activity_ids, i)
+
+
+class _ActivityPaths:
+    """Пути видов деятельности по возрастанию - для bisect"""
+
+    def __init__(self, snap: Snapshot):
+        self._snap = snap
+
+    def __len__(self) -> int:
+        return len(self._snap._activity_parents)
+
+    def __getitem__(self, i: int) -> str:
+        return self._snap._path(i)
+
+
+class _ActivityChildren:
+    """Дети вида деятельности: {id: [id детей]} поверх снимка. Дети лежат в поддереве узла,
+    а поддерево в порядке путей - непрерывный отрезок сразу после узла"""
+
+    def __init__(self, snap: Snapshot):
+        self._snap = snap
+
+    def get(self, activity_id: UUID, default=None):
+        snap = self._snap
+        if (i := snap._activities.row(activity_id)) is None:
+            return default
+        end = bisect_left(snap.activity_paths, snap._path(i) + "~", i + 1)  # "~" больше любого символа пути
+        return [snap._uuid(snap._activity_ids, k) for k in range(i + 1, end) if snap._activity_parents[k] == i]
+
+
+def write_snapshot(path: Path, generation: int, position: Position,
+                   buildings: dict[UUID, tuple[float, float]],
+                   organizations: dict[UUID, UUID],
+                   activities: dict[UUID, ActivityRow]):
+    """Записать снимок в файл path (через временный файл - недописанный снимок никто не увидит)"""
+    cells: dict[tuple[int, int], list[UUID]] = {}
+    for building_id, (latitude, longitude) in buildings.items():
+        cells.setdefault(grid_cell(latitude, longitude), []).append(building_id)
+    cell_keys = sorted(cells)
+    building_ids = [building_id for cell in cell_keys for building_id in sorted(cells[cell])]
+    building_index = {building_id: i for i, building_id in enumerate(building_ids)}
+    grid_starts, total = array("I", [0]), 0
+    for cell in cell_keys:
+        total += len(cells[cell])
+        grid_starts.append(total)
+
+    organization_ids = sorted(org_id for org_id, building_id in organizations.items() if building_id in building_index)
+
+    # суммы тайлов: ячейка уровня level - это ячейка верхнего уровня, сдвинутая на разницу уровней
+    tiles: dict[int, list] = {}
+    top = TILE_LEVELS - 1
+    for building_id, count in Counter(organizations[org_id] for org_id in organization_ids).items():
+        latitude, longitude = buildings[building_id]
+        x, y = mercator_cell(latitude, longitude, top)
+        for level in range(TILE_LEVELS):
+            cell = tiles.setdefault(_tile_key(level, x >> top - level, y >> top - level), [0, 0.0, 0.0])
+            cell[0] += count
+            cell[1] += latitude * count
+            cell[2] += longitude * count
+    tile_keys = sorted(tiles)
+
+    rows = sorted(activities.values(), key=lambda row: row[4])
+    activity_index = {row[0]: i for i, row in enumerate(rows)}
+    names = [row[1].encode() for row in rows]
+    paths = [row[4].encode() for row in rows]
+
+    def offsets(parts: list[bytes]) -> array:
+        result, total = array("I", [0]), 0
+        for part in parts:
+            total += len(part)
+            result.append(total)
+        return result
+
+    sections = (
+        b"".join(building_id.bytes for building_id in building_ids),
+        array("d", (buildings[building_id][0] for building_id in building_ids)).tobytes(),
+        array("d", (buildings[building_id][1] for building_id in building_ids)).tobytes(),
+        array("I", sorted(range(len(building_ids)), key=building_ids.__getitem__)).tobytes(),
+        array("Q", (_grid_key(*cell) for cell in cell_keys)).tobytes(),
+        grid_starts.tobytes(),
+        b"".join(org_id.bytes for org_id in organization_ids),
+        array("I", (building_index[organizations[org_id]] for org_id in organization_ids)).tobytes(),
+        b"".join(row[0].bytes for row in rows),
+        array("I", sorted(range(len(rows)), key=lambda i: rows[i][0])).tobytes(),
+        array("i", (activity_index.get(row[2], -1) for row in rows)).tobytes(),
+        array("I", (row[3] for row in rows)).tobytes(),
+        offsets(names).tobytes(),
+        offsets(paths).tobytes(),
+        array("Q", tile_keys).tobytes(),
+        array("I", (tiles[key][0] for key in tile_keys)).tobytes(),
+        array("d", (tiles[key][1] for key in tile_keys)).tobytes(),
+        array("d", (tiles[key][2] for key in tile_keys)).tobytes(),
+        b"".join(names),
+        b"".join(paths),
+    )
+    counts = (len(building_ids), len(organization_ids), len(rows), len(sections[-2]), len(sections[-1]),
+              len(cell_keys), len(tile_keys))
+    layout = _Layout.of(*counts)
+    buffer = bytearray(max(_HEADER.size, layout.paths.stop) or 1)
+    _HEADER.pack_into(buffer, 0, MAGIC, generation, *position, _parent_token(), *counts)
+    for section, data in zip(layout, sections, strict=True):
+        buffer[section] = data
+
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "wb") as file:
+        file.write(buffer)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, path)
+
+
+class SnapshotStore(MemoryIndex):
+    """Текущее поколение снимка в каталоге directory.
+    После коммита, изменившего здания, организации или виды деятельности (в этом процессе или,
+    по журналу, в другом), следующее поколение публикуется в фоне; индексы, читающие снимок,
+    дожидаются его через ensure"""
+    keys = {Building: "id", Organization: "id", Activity: "id"}
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = Path(directory) if directory else None
+        self.snapshot: Snapshot | None = None
+        self._publishing: asyncio.Task | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    async def read(self, session: AsyncSession) -> Snapshot | None:
+        """Актуальный снимок; None, если снимок выключен"""
+        if self.directory is None:
+            return None
+        await self.ensure(session)
+        return self.snapshot
+
+    @asynccontextmanager
+    async def _locked(self) -> AsyncIterator[None]:
+        """Межпроцессная блокировка каталога: поколения публикуются по одному"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / "lock", "wb") as lock:
+            await asyncio.to_thread(fcntl.flock, lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _current(self) -> Snapshot | None:
+        pointer = self.directory / _POINTER
+        try:
+            return Snapshot(self.directory / pointer.read_text().strip())
+        except (OSError, ValueError, struct.error):
+            return None
+
+    async def load(self, session: AsyncSession):
+        if self.directory is None:
+            return
+        async with self._locked():
+            current = self._current()
+            # снимок прежнего запуска мог пропустить изменения, сделанные без журнала
+            await self._update(session, current if current and current.token == _parent_token() else None)
+
+    async def refresh(self, session: AsyncSession, ids: set[UUID]):
+        async with self._locked():
+            await self._update(session, self._current())
+
+    async def _update(self, session: AsyncSession, base: Snapshot | None):
+        """Подключиться к поколению base, если в нём есть все изменения, иначе опубликовать следующее.
+        Изменённые с base записи берутся из журнала - их могли закоммитить и другие процессы"""
+        if base is not None and base.position >= journal.position:
+            self.snapshot = base
+            return
+        end = journal.end()  # всё, что записано в журнал до этой позиции, уже закоммичено
+        ids = journal.changes(base.position, end, type(self).__name__) if base is not None else None
+        if ids is None:
+            await self._build(session, end)
+        elif ids:
+            await self._apply(session, base, end, ids)
+        else:
+            self.snapshot = base
+
+    async def _build(self, session: AsyncSession, position: Position):
+        """Следующее поколение целиком из БД"""
+        buildings = {row.id: (row.latitude, row.longitude) for row in
+                     await session.execute(select(Building.id, Building.latitude, Building.longitude))}
+        organizations = dict((await session.execute(select(Organization.id, Organization.building_id))).all())
+        activities = {row[0]: tuple(row) for row in await session.execute(
+            select(Activity.id, Activity.name, Activity.parent_id, Activity.level, Activity.path))}
+        self._publish(position, buildings, organizations, activities)
+
+    async def _apply(self, session: AsyncSession, base: Snapshot, position: Position, ids: set[UUID]):
+        """Следующее поколение из base и перечитанных записей ids"""
+        buildings = {building_id: (lat, lon) for building_id, lat, lon in base.buildings()}
+        organizations = dict(base.organizations())
+        activities = {row[0]: row for row in base.activities()}
+        for records in (buildings, organizations, activities):
+            for record_id in ids:
+                records.pop(record_id, None)
+        for row in await session.execute(
+                select(Building.id, Building.latitude, Building.longitude).where(Building.id.in_(ids))):
+            buildings[row.id] = (row.latitude, row.longitude)
+        for row in await session.execute(
+                select(Organization.id, Organization.building_id).where(Organization.id.in_(ids))):
+            organizations[row.id] = row.building_id
+        for row in await session.execute(
+                select(Activity.id, Activity.name, Activity.parent_id, Activity.level, Activity.path)
+                .where(Activity.id.in_(ids))):
+            activities[row[0]] = tuple(row)
+        self._publish(position, buildings, organizations, activities)
+
+    def _publish(self, position: Position, *data):
+        """Записать следующее поколение, переключить на него указатель и удалить старые файлы
+        (процессы, которые ещё читают старое поколение, держат его отображение до переключения)"""
+        generation = (current.generation if (current := self._current()) else 0) + 1
+        name = f"snapshot-{generation:012d}.bin"
+        write_snapshot(self.directory / name, generation, position, *data)
+        tmp = self.directory / f"{_POINTER}.tmp"
+        tmp.write_text(name)
+        os.replace(tmp, self.directory / _POINTER)
+        self.snapshot = self._current()
+        for path in self.directory.glob("snapshot-*.bin"):
+            if path.name != name:
+                path.unlink(missing_ok=True)
+        logger.info(f"Опубликован снимок поколения {generation}")
+
+    def invalidate(self, ids=None):
+        super().invalidate(ids)
+        # новое поколение публикуется сразу после коммита, а не при следующем чтении в этом процессе
+        if self.directory is None or not self._loaded or (self._publishing and not self._publishing.done()):
+            return
+        try:
+            self._publishing = asyncio.get_running_loop().create_task(self._publish_changes())
+        except RuntimeError:  # коммит вне цикла событий - опубликует ближайший ensure
+            pass
+
+    async def _publish_changes(self):
+        try:
+            async with AsyncSessionLocal() as session:
+                await self.ensure(session)
+        except Exception:
+            logger.exception("Не удалось опубликовать снимок")
+
+
+snapshot = SnapshotStore(settings.SNAPSHOT_DIR)
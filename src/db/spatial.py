@@ -0,0 +1,117 @@
+"""Пространственный индекс зданий"""
+from collections.abc import Iterator
+from uuid import UUID
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.geo import (
+    GRID_CELL_DEG,
+    HALF_CIRCUMFERENCE_KM,
+    Accuracy,
+    bounding_boxes,
+    distances_km,
+    grid_cell,
+)
+from .memory import MemoryIndex
+from .models import Building
+from .snapshot import snapshot
+
+Point = tuple[UUID, float, float]  # id здания, широта, долгота
+
+
+class SpatialIndex(MemoryIndex):
+    """Сетка по координатам зданий: ячейка cell_deg x cell_deg градусов -> здания в ней.
+    При включённом снимке сетка и координаты читаются прямо из него (та же сетка GRID_CELL_DEG)"""
+    keys = {Building: "id"}
+
+    def __init__(self, cell_deg: float = GRID_CELL_DEG):
+        super().__init__()
+        self.cell_deg = cell_deg
+        self._points: dict[UUID, tuple[float, float]] = {}
+        self._cells: dict[tuple[int, int], dict[UUID, tuple[float, float]]] = {}
+
+    def _cell(self, latitude: float, longitude: float) -> tuple[int, int]:
+        return grid_cell(latitude, longitude, self.cell_deg)
+
+    def _put(self, building_id: UUID, latitude: float, longitude: float):
+        self._points[building_id] = (latitude, longitude)
+        self._cells.setdefault(self._cell(latitude, longitude), {})[building_id] = (latitude, longitude)
+
+    def _remove(self, building_id: UUID):
+        if (point := self._points.pop(building_id, None)) is None:
+            return
+        cell = self._cell(*point)
+        del self._cells[cell][building_id]
+        if not self._cells[cell]:
+            del self._cells[cell]
+
+    async def load(self, session: AsyncSession):
+        if (snap := await snapshot.read(session)) is not None:
+            self.cell_deg, self._points, self._cells = GRID_CELL_DEG, snap.points, snap.grid
+            return
+        points = (await session.execute(select(Building.id, Building.latitude, Building.longitude))).all()
+        self._points, self._cells = {}, {}
+        for building_id, latitude, longitude in points:
+            self._put(building_id, latitude, longitude)
+
+    async def refresh(self, session: AsyncSession, ids: set[UUID]):
+        if snapshot.enabled:  # изменения уже в следующем поколении снимка
+            return await self.load(session)
+        stmt = select(Building.id, Building.latitude, Building.longitude).where(Building.id.in_(ids))
+        result = await session.execute(stmt)
+        for building_id in ids:
+            self._remove(building_id)
+        for building_id, latitude, longitude in result.all():
+            self._put(building_id, latitude, longitude)
+
+    def in_box(self, lat_min: float, lat_max: float, lon_min: float, lon_max: float) -> Iterator[Point]:
+        """Здания внутри прямоугольника (границы включительно)"""
+        i_min, j_min = self._cell(lat_min, lon_min)
+        i_max, j_max = self._cell(lat_max, lon_max)
+        if (i_max - i_min + 1) * (j_max - j_min + 1) <= len(self._cells):
+            cells = (self._cells.get((i, j)) for i in range(i_min, i_max + 1) for j in range(j_min, j_max + 1))
+        else:  # рамка больше заполненной части сетки - дешевле пройти по непустым ячейкам
+            cells = (points for (i, j), points in self._cells.items() if i_min <= i <= i_max and j_min <= j <= j_max)
+        for points in cells:
+            for building_id, (latitude, longitude) in points.items() if points else ():
+                if lat_min <= latitude <= lat_max and lon_min <= longitude <= lon_max:
+                    yield building_id, latitude, longitude
+
+    def distances(self, latitude: float, longitude: float, radius_km: float,
+                  accuracy: Accuracy = "exact") -> dict[UUID, float]:
+        """Здания на расстоянии не больше radius_km от точки: id здания -> расстояние в км"""
+        candidates = {
+            building_id: (lat, lon)
+            for box in bounding_boxes(latitude, longitude, radius_km, accuracy)
+            for building_id, lat, lon in self.in_box(*box)
+        }
+        distances = distances_km(latitude, longitude, candidates.values(), accuracy)
+        return {
+            building_id: distance
+            for building_id, distance in zip(candidates, distances, strict=True)
+            if distance <= radius_km
+        }
+
+    def nearest(self, latitude: float, longitude: float, accuracy: Accuracy = "exact",
+                max_km: float = HALF_CIRCUMFERENCE_KM, start_km: float = 1.0) -> Iterator[tuple[UUID, float]]:
+        """Здания не дальше max_km в порядке удаления от точки: (id здания, расстояние в км).
+        Радиус поиска удваивается от start_km, пока не дойдёт до max_km -
+        каждое следующее кольцо дальше всех уже отданных зданий."""
+        seen: set[UUID] = set()
+        radius_km = min(start_km, max_km)
+        while len(seen) < len(self._points):
+            ring = sorted(
+                (distance, building_id)
+                for building_id, distance in self.distances(latitude, longitude, radius_km, accuracy).items()
+                if building_id not in seen
+            )
+            for distance, building_id in ring:
+                seen.add(building_id)
+                yield building_id, distance
+            if radius_km >= max_km:
+                return
+            radius_km = min(radius_km * 2, max_km)
+
+
+spatial_index = SpatialIndex()
@@ -0,0 +1,89 @@
+"""Агрегат организаций по тайлам карты"""
+from uuid import UUID
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.geo import MAX_ZOOM, TILE_CELL_BITS, mercator_cell
+from .memory import MemoryIndex
+from .models import Building, Organization
+from .snapshot import snapshot
+
+
+class TileIndex(MemoryIndex):
+    """Число организаций и их центроид в ячейках Web Mercator всех уровней масштаба.
+    Ячейки тайла z/x/y - это тайлы уровня z + TILE_CELL_BITS, поэтому ответ собирается из готовых сумм.
+    При включённом снимке суммы читаются прямо из него"""
+    keys = {Building: "id", Organization: "building_id"}
+
+    def __init__(self):
+        super().__init__()
+        self._buildings: dict[UUID, tuple[float, float, int]] = {}  # широта, долгота, число организаций
+        self._cells: dict[tuple[int, int, int], list] = {}  # (уровень, x, y) -> [число, сумма широт, сумма долгот]
+
+    @staticmethod
+    def _stmt():
+        return (
+            select(Building.id, Building.latitude, Building.longitude, func.count(Organization.id))
+            .outerjoin(Organization, Organization.building_id == Building.id)
+            .group_by(Building.id)
+        )
+
+    def _apply(self, latitude: float, longitude: float, count: int):
+        """Добавить (count > 0) или вычесть (count < 0) организации здания во всех уровнях"""
+        for level in range(MAX_ZOOM + TILE_CELL_BITS + 1):
+            key = (level, *mercator_cell(latitude, longitude, level))
+            cell = self._cells.setdefault(key, [0, 0.0, 0.0])
+            cell[0] += count
+            cell[1] += latitude * count
+            cell[2] += longitude * count
+            if cell[0] <= 0:
+                del self._cells[key]
+
+    def _put(self, building_id: UUID, latitude: float, longitude: float, count: int):
+        if count:
+            self._buildings[building_id] = (latitude, longitude, count)
+            self._apply(latitude, longitude, count)
+
+    def _remove(self, building_id: UUID):
+        if (building := self._buildings.pop(building_id, None)) is not None:
+            latitude, longitude, count = building
+            self._apply(latitude, longitude, -count)
+
+    async def load(self, session: AsyncSession):
+        if (snap := await snapshot.read(session)) is not None:
+            self._buildings, self._cells = {}, snap.tiles
+            return
+        rows = (await session.execute(self._stmt())).all()
+        self._buildings, self._cells = {}, {}
+        for row in rows:
+            self._put(*row)
+
+    async def refresh(self, session: AsyncSession, ids: set[UUID]):
+        if snapshot.enabled:  # изменения уже в следующем поколении снимка
+            return await self.load(session)
+        result = await session.execute(self._stmt().where(Building.id.in_(ids)))
+        for building_id in ids:
+            self._remove(building_id)
+        for row in result.all():
+            self._put(*row)
+
+    def tile(self, z: int, x: int, y: int) -> list[dict]:
+        """Непустые ячейки тайла: координаты ячейки, число организаций и их центроид"""
+        level, size = z + TILE_CELL_BITS, 1 << TILE_CELL_BITS
+        cells = []
+        for cell_x in range(x * size, (x + 1) * size):
+            for cell_y in range(y * size, (y + 1) * size):
+                if cell := self._cells.get((level, cell_x, cell_y)):
+                    count, sum_lat, sum_lon = cell
+                    cells.append({
+                        "x": cell_x,
+                        "y": cell_y,
+                        "count": count,
+                        "latitude": sum_lat / count,
+                        "longitude": sum_lon / count,
+                    })
+        return cells
+
+
+tile_index = TileIndex()
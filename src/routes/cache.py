@@ -0,0 +1,115 @@
+"""Кэш ответов GET-маршрутов"""
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import NamedTuple
+
+from fastapi import APIRouter, Request, Response
+from fastapi.routing import APIRoute
+from starlette.responses import StreamingResponse
+
+from ..core.config import settings
+
+router = APIRouter(prefix='/debug/cache', tags=['Отладка'])
+
+
+class CachedBody(NamedTuple):
+    versions: tuple[int, ...]  # версии таблиц, из которых собран ответ
+    expires: float
+    body: bytes
+    headers: list[tuple[bytes, bytes]]
+
+
+class ResponseCache:
+    """LRU-кэш готовых тел ответов с TTL.
+    Запись помнит версии таблиц на момент чтения: после коммита, изменившего любую из них,
+    она больше не отдаётся - ответ собирается заново. Хранит не больше size записей (0 - кэш выключен)
+    и не больше max_bytes байт тел; тела больше max_body не кэшируются.
+    Кэш у каждого процесса свой; коммиты других воркеров меняют его версии таблиц только через общий
+    журнал (SNAPSHOT_DIR) - без него кэш верен лишь при одном воркере"""
+
+    def __init__(self, size: int, ttl: float, max_bytes: int, max_body: int):
+        self.size, self.ttl = size, ttl
+        self.max_bytes, self.max_body = max_bytes, max_body
+        self._entries: OrderedDict[str, CachedBody] = OrderedDict()
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = self.skipped = 0
+
+    def _pop(self, key: str) -> CachedBody:
+        entry = self._entries.pop(key)
+        self.bytes -= len(entry.body)
+        return entry
+
+    def get(self, key: str, versions: tuple[int, ...]) -> CachedBody | None:
+        entry = self._entries.get(key)
+        if entry is None or entry.versions != versions or entry.expires < time.monotonic():
+            if entry is not None:
+                self._pop(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def set(self, key: str, versions: tuple[int, ...], response: Response):
+        if not self.size:
+            return
+        if len(response.body) > min(self.max_body, self.max_bytes):
+            self.skipped += 1
+            return
+        if key in self._entries:
+            self._pop(key)
+        self._entries[key] = CachedBody(versions, time.monotonic() + self.ttl, response.body, response.raw_headers)
+        self.bytes += len(response.body)
+        while len(self._entries) > self.size or self.bytes > self.max_bytes:
+            self._pop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "max_size": self.size, "bytes": self.bytes,
+                "max_bytes": self.max_bytes, "max_body": self.max_body, "ttl": self.ttl,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions, "skipped": self.skipped}
+
+
+response_cache = ResponseCache(settings.RESPONSE_CACHE_SIZE, settings.RESPONSE_CACHE_TTL,
+                               settings.RESPONSE_CACHE_BYTES, settings.RESPONSE_CACHE_MAX_BODY)
+
+
+class CachedResponse(Exception):
+    """Ответ найден в кэше - выбрасывается зависимостью маршрута, чтобы не выполнять обработчик"""
+
+    def __init__(self, entry: CachedBody):
+        self.entry = entry
+
+
+class CachedRoute(APIRoute):
+    """Маршрут с кэшем ответов. Ключ и версии таблиц кладёт в request.state.cache зависимость conditional
+    (после проверки API-ключа); успешный ответ без потока сохраняется под этим ключом"""
+    cache = response_cache
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            try:
+                response = await handler(request)
+            except CachedResponse as hit:
+                response = Response(hit.entry.body)
+                response.raw_headers = list(hit.entry.headers)
+                return response
+            entry = getattr(request.state, "cache", None)
+            if entry and response.status_code == 200 and not isinstance(response, StreamingResponse):
+                self.cache.set(*entry, response)
+            return response
+
+        return route_handler
+
+
+@router.get("/")
+def route_get_cache_stats() -> dict:
+    """Счётчики кэша ответов"""
+    return response_cache.stats()
@@ -0,0 +1,28 @@
+"""Непрозрачные курсоры постраничной выдачи"""
+import base64
+import binascii
+import json
+from collections.abc import Callable
+from typing import Any
+from uuid import UUID
+
+from fastapi import HTTPException
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"  # заголовок ответа с курсором следующей страницы
+
+
+def encode_cursor(*values: Any) -> str:
+    """Упаковывает значения ключа последней записи страницы в строку"""
+    raw = json.dumps([str(value) if isinstance(value, UUID) else value for value in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, *types: Callable[[Any], Any]) -> tuple:
+    """Распаковывает курсор и приводит значения к types"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError(cursor)
+        return tuple(cast(value) for cast, value in zip(types, values, strict=True))
+    except (ValueError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
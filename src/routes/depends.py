@@ -1,11 +1,12 @@
+from collections.abc import Iterable
 from uuid import UUID
 
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Query
 from fastapi.security.api_key import APIKeyHeader
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from ..core.config import settings
-from ..db.models import Activity
+from ..db.activities import ActivityTree, activity_tree
 
 # Static API key for authentication
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
@@ -17,12 +18,37 @@ async def verify_api_key(api_key: str = Depends(api_key_header)):
     return api_key
 
 
+def activity_error(tree: ActivityTree, activity_id: UUID) -> HTTPException | None:
+    """Ошибка, если вида деятельности нет или он глубже ACTIVITY_MAX_LEVEL"""
+    activity = tree.get(activity_id)
+    if not activity:
+        return HTTPException(status_code=404,
+                             detail="No organizations found for this activity tree")
+    if activity.level > settings.ACTIVITY_MAX_LEVEL:
+        return HTTPException(status_code=400,
+                             detail=f"Activity level exceeds maximum ({settings.ACTIVITY_MAX_LEVEL}) or not found")
+    return None
+
+
+def activities_error(tree: ActivityTree, activity_ids: Iterable[UUID]) -> HTTPException | None:
+    """Первая ошибка среди видов деятельности"""
+    return next(filter(None, (activity_error(tree, activity_id) for activity_id in activity_ids)), None)
+
+
 # Helper function to check activity level
 async def validate_activity_level(activity_id: UUID, session: AsyncSession) -> bool:
-    activity = await session.get(Activity, activity_id)
-    if not activity:
-        raise HTTPException(status_code=404,
-                            detail="No organizations found for this activity tree")
-    if activity.level > 3:
-        raise HTTPException(status_code=400, detail="Activity level exceeds maximum (3) or not found")
+    """Проверка по дереву видов деятельности в памяти - без запроса в БД, пока дерево актуально"""
+    if error := activity_error(await activity_tree.ensure(session), activity_id):
+        raise error
     return True
+
+
+INCLUDES = ("phones", "activities", "building")
+
+
+def parse_include(include: str | None = Query(None, description="Связанные данные через запятую: "
+                                                               "phones, activities, building")) -> frozenset[str]:
+    names = frozenset(name.strip() for name in (include or "").split(",") if name.strip())
+    if unknown := names - set(INCLUDES):
+        raise HTTPException(status_code=400, detail=f"Неизвестные значения include: {', '.join(sorted(unknown))}")
+    return names
@@ -1,9 +1,11 @@
 import datetime as dt
-from typing import List, Optional
+from typing import Annotated, List, Optional
 from uuid import UUID
 
 from pydantic import BaseModel, Field
 
+from ..core.geo import Accuracy
+
 
 class PhoneDTO(BaseModel):
     phone_number: str
@@ -16,11 +18,31 @@ class ActivityDTO(BaseModel):
     level: int
 
 
+class BuildingDTO(BaseModel):
+    id: UUID
+    address: str
+    latitude: float
+    longitude: float
+
+
 class OrganizationDTO(BaseModel):
     id: UUID
     name: str
     building_id: UUID
     created_at: dt.datetime
+    # связанные данные - только если запрошены параметром include
+    phone_numbers: Optional[List[PhoneDTO]] = None
+    activities: Optional[List[ActivityDTO]] = None
+    building: Optional[BuildingDTO] = None
+
+
+class NameCompletionDTO(BaseModel):
+    id: UUID
+    name: str
+
+
+class OrganizationDistanceDTO(OrganizationDTO):
+    distance_km: Optional[float] = None  # есть только при поиске от точки
 
 
 class OrganizationCreateDTO(BaseModel):
@@ -30,6 +52,23 @@ class OrganizationCreateDTO(BaseModel):
     activity_ids: List[UUID]
 
 
+class OrganizationBulkDTO(BaseModel):
+    organizations: List[OrganizationCreateDTO] = Field(..., min_length=1, max_length=10_000)
+
+
+class BulkItemDTO(BaseModel):
+    index: int  # номер организации в запросе
+    status: int  # 201 - создана, иначе код ошибки, как у POST /organizations/
+    id: Optional[UUID] = None
+    detail: Optional[str] = None
+
+
+class BulkResultDTO(BaseModel):
+    created: int
+    failed: int
+    items: List[BulkItemDTO]
+
+
 class OrganizationUpdateDTO(BaseModel):
     name: Optional[str] = None
     building_id: Optional[UUID] = None
@@ -37,11 +76,75 @@ class OrganizationUpdateDTO(BaseModel):
     activity_ids: Optional[List[UUID]] = None
 
 
+class ActivityFilterDTO(BaseModel):
+    all_of: List[UUID] = []  # организация должна относиться к каждому из видов деятельности
+    any_of: List[UUID] = []  # хотя бы к одному
+    none_of: List[UUID] = []  # ни к одному
+    include_subtree: bool = False  # вид деятельности засчитывается вместе со всем поддеревом
+    # Постраничная выдача по возрастанию id, курсор следующей страницы приходит в заголовке X-Next-Cursor
+    limit: Optional[int] = Field(None, ge=1, le=1000)
+    after: Optional[str] = None
+
+
+class PointDTO(BaseModel):
+    latitude: float = Field(..., ge=-90, le=90)
+    longitude: float = Field(..., ge=-180, le=180)
+
+
 class GeoSearchDTO(BaseModel):
     latitude: Optional[float] = Field(None, ge=-90, le=90)
     longitude: Optional[float] = Field(None, ge=-180, le=180)
     radius_km: Optional[float] = None  # For circular search
+    accuracy: Accuracy = Field("exact", description="Расчёт расстояний: exact - эллипсоид WGS84, "
+                                                    "fast - сфера, погрешность до 0.57%")
+    # Постраничная выдача: по радиусу организации идут по возрастанию расстояния, иначе - по возрастанию id;
+    # курсор следующей страницы приходит в заголовке X-Next-Cursor
+    limit: Optional[int] = Field(None, ge=1, le=1000)
+    after: Optional[str] = None
     lat_min: Optional[float] = None  # For rectangular search
     lat_max: Optional[float] = None
     lon_min: Optional[float] = None
-    lon_max: Optional[float] = None
\ No newline at end of file
+    lon_max: Optional[float] = None
+    # For polygon search: контуры районов, здание подходит, если попало хотя бы в один
+    polygons: Optional[List[Annotated[List[PointDTO], Field(min_length=3)]]] = Field(None, min_length=1)
+
+
+class NearestSearchDTO(BaseModel):
+    latitude: float = Field(..., ge=-90, le=90)
+    longitude: float = Field(..., ge=-180, le=180)
+    k: int = Field(10, ge=1, le=1000)  # сколько ближайших организаций вернуть
+    accuracy: Accuracy = "exact"
+
+
+class TileCellDTO(BaseModel):
+    x: int  # ячейка - тайл уровня z + 3
+    y: int
+    count: int  # число организаций
+    latitude: float  # центроид организаций ячейки
+    longitude: float
+
+
+class TileDTO(BaseModel):
+    z: int
+    x: int
+    y: int
+    count: int
+    cells: List[TileCellDTO]
+
+
+class FacetSearchDTO(BaseModel):
+    # Ограничение выборки: здание и/или область (радиус от точки, прямоугольник или многоугольники)
+    building_id: Optional[UUID] = None
+    latitude: Optional[float] = Field(None, ge=-90, le=90)
+    longitude: Optional[float] = Field(None, ge=-180, le=180)
+    radius_km: Optional[float] = None
+    accuracy: Accuracy = "exact"
+    lat_min: Optional[float] = None
+    lat_max: Optional[float] = None
+    lon_min: Optional[float] = None
+    lon_max: Optional[float] = None
+    polygons: Optional[List[Annotated[List[PointDTO], Field(min_length=3)]]] = Field(None, min_length=1)
+
+
+class ActivityFacetDTO(ActivityDTO):
+    count: int  # организаций в поддереве вида деятельности
@@ -0,0 +1,55 @@
+"""ETag, условные GET-запросы и кэш ответов"""
+import hashlib
+import uuid
+from collections.abc import Callable
+
+from fastapi import Depends, HTTPException, Request, Response
+
+from ..db.memory import table_versions
+from .cache import CachedResponse, response_cache
+from .depends import parse_include
+
+# Версии таблиц - счётчики процесса, поэтому ETag разных процессов не совпадают (клиент, попавший
+# в другой воркер, получит полный ответ, а не 304). Чужие записи меняют версии этого процесса через
+# общий журнал (SNAPSHOT_DIR), который роутер дочитывает до проверки ETag; без журнала устаревший 304
+# после записи в другом воркере возможен - ETag верен только при одном воркере
+_PROCESS = uuid.uuid4().hex
+# таблицы, которые добавляет к ответу include
+_INCLUDE_TABLES = {
+    "phones": ("organization_phone",),
+    "activities": ("organization_activity", "activity"),
+    "building": ("building",),
+}
+
+
+def _matches(etag: str, header: str) -> bool:
+    """If-None-Match: список ETag через запятую или *, сравнение слабое (без W/)"""
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in tags or etag in tags
+
+
+def conditional(*models: type) -> Callable:
+    """Зависимость маршрута: сильный ETag из URL, Accept и версий таблиц models (и таблиц include).
+    Совпал с If-None-Match - 304 до запроса в БД и сериализации, иначе ETag уходит в заголовке ответа.
+    Тот же URL и Accept - ключ кэша ответов: запись с текущими версиями таблиц отдаётся без обработчика
+    (маршрут должен быть CachedRoute)"""
+    tables = tuple(model.__tablename__ for model in models)
+
+    def dependency(request: Request, response: Response, include: frozenset[str] = Depends(parse_include)):
+        used = sorted({*tables, *(table for name in include for table in _INCLUDE_TABLES[name])})
+        versions = table_versions(*used)
+        key = "|".join((
+            request.url.path,
+            str(sorted(request.query_params.multi_items())),
+            request.headers.get("accept", ""),
+        ))
+        etag_key = "|".join((_PROCESS, key, str(used), str(versions)))
+        etag = f'"{hashlib.sha256(etag_key.encode()).hexdigest()[:32]}"'
+        if _matches(etag, request.headers.get("if-none-match", "")):
+            raise HTTPException(status_code=304, headers={"ETag": etag})
+        if (entry := response_cache.get(key, versions)) is not None:
+            raise CachedResponse(entry)
+        request.state.cache = key, versions
+        response.headers["ETag"] = etag
+
+    return dependency
@@ -0,0 +1,37 @@
+"""Быстрая выдача JSON без повторной валидации ответа"""
+from collections.abc import Callable
+from functools import cache
+from typing import Any
+
+from fastapi import Response
+from pydantic import BaseModel
+from pydantic_core import to_json
+
+from ..core.config import settings
+
+
+class FastJSONResponse(Response):
+    """JSON-ответ, который кодируется сразу в байты сериализатором pydantic-core (UUID, datetime - как у моделей)"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return to_json(content)
+
+
+@cache
+def projection(model: type[BaseModel]) -> Callable[[dict], dict]:
+    """Оставляет в строке из БД только поля модели ответа, отсутствующие - значением по умолчанию.
+    Список полей и значений по умолчанию вычисляется один раз на модель"""
+    defaults = tuple((name, field.get_default()) for name, field in model.model_fields.items())
+    return lambda row: {name: row.get(name, default) for name, default in defaults}
+
+
+def fast_json(response: Response, model: type[BaseModel], content: dict | list[dict]):
+    """При FAST_JSON отдаёт строки из БД готовым ответом, минуя проверку по response_model
+    и jsonable_encoder; схема OpenAPI по-прежнему берётся из response_model маршрута.
+    Без FAST_JSON возвращает content как есть - на обычную валидацию"""
+    if not settings.FAST_JSON:
+        return content
+    project = projection(model)
+    body = [project(row) for row in content] if isinstance(content, list) else project(content)
+    return FastJSONResponse(body, status_code=response.status_code or 200, headers=response.headers)
@@ -0,0 +1,199 @@
+"""Потоковый импорт справочника из CSV/NDJSON"""
+import csv
+import datetime as dt
+import io
+import json
+import time
+from collections.abc import Iterator
+from itertools import islice
+from typing import NamedTuple
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, File, HTTPException, Path, Security, UploadFile
+from pydantic import BaseModel, Field, ValidationError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..db.activities import activity_tree
+from ..db.bulk import bulk_writer
+from ..db.memory import mark_changed
+from ..db.models import Building, Organization, OrganizationActivity, OrganizationPhone
+from ..db.session import get_db
+from .depends import activity_error, verify_api_key
+from .stream import NDJSON
+
+router = APIRouter(prefix="/import", tags=["Импорт"])
+
+IMPORT_CHUNK = 5000  # строк, которые проверяются и записываются за раз - память не зависит от размера файла
+MAX_ERRORS = 100  # отклонённых строк, описанных в отчёте (счёт ведётся по всем)
+
+
+class BuildingRow(BaseModel):
+    id: UUID | None = None
+    address: str = Field(..., min_length=1)
+    latitude: float = Field(..., ge=-90, le=90)
+    longitude: float = Field(..., ge=-180, le=180)
+
+
+class OrganizationRow(BaseModel):
+    id: UUID | None = None
+    name: str = Field(..., min_length=1)
+    building_id: UUID
+
+
+class PhoneRow(BaseModel):
+    organization_id: UUID
+    phone_number: str = Field(..., min_length=1)
+
+
+class ActivityLinkRow(BaseModel):
+    organization_id: UUID
+    activity_id: UUID
+
+
+class ImportErrorDTO(BaseModel):
+    line: int  # строка файла (у CSV - с заголовком)
+    detail: str
+
+
+class ImportReportDTO(BaseModel):
+    kind: str
+    rows: int
+    imported: int
+    rejected: int
+    seconds: float
+    rows_per_second: float
+    errors: list[ImportErrorDTO]
+
+
+class ImportKind(NamedTuple):
+    model: type  # строку таблицы из полей строки импорта собирает model.record
+    row: type[BaseModel]
+    references: dict[str, type]  # поле строки -> модель, в которой должна быть запись с таким id
+    unique: tuple[str, ...] = ("id",)  # столбцы, сочетание которых не должно повторяться в таблице
+
+
+KINDS = {
+    "buildings": ImportKind(Building, BuildingRow, {}),
+    "organizations": ImportKind(Organization, OrganizationRow, {"building_id": Building}),
+    "phones": ImportKind(OrganizationPhone, PhoneRow, {"organization_id": Organization},
+                         ("organization_id", "phone_number")),
+    "activities": ImportKind(OrganizationActivity, ActivityLinkRow, {"organization_id": Organization},
+                             ("organization_id", "activity_id")),
+}
+
+Row = tuple[int, dict | str]  # номер строки файла и поля или ошибка разбора
+
+
+def _read_rows(file: UploadFile) -> Iterator[Row]:
+    """Строки загруженного файла по одной (файл загрузки уже лежит во временном файле на диске)"""
+    name, content_type = (file.filename or "").lower(), file.content_type or ""
+    text = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    if name.endswith(".csv") or content_type.startswith("text/csv"):
+        reader = csv.DictReader(text)
+        for row in reader:
+            # пустое поле - как отсутствующее; лишние столбцы (ключ None) не нужны
+            yield reader.line_num, {key: value for key, value in row.items()
+                                    if key is not None and value not in ("", None)}
+    elif name.endswith((".ndjson", ".jsonl")) or content_type.startswith(NDJSON):
+        for number, line in enumerate(text, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield number, f"Некорректный JSON: {e}"
+                continue
+            yield number, row if isinstance(row, dict) else "Строка должна быть объектом JSON"
+    else:
+        raise HTTPException(status_code=415, detail="Поддерживаются файлы CSV и NDJSON")
+
+
+def _error_text(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(map(str, error['loc'])) or 'строка'}: {error['msg']}" for error in e.errors())
+
+
+async def import_rows(session: AsyncSession, kind: ImportKind, rows: Iterator[Row]) -> dict:
+    """Проверка и запись строк пачками по IMPORT_CHUNK. Ссылки (здание, организация) и повторы
+    (id, пары организация - телефон и организация - вид деятельности) проверяются одним запросом на пачку,
+    виды деятельности - по дереву в памяти.
+    Ошибочные строки отклоняются, остальные пишутся; вызывающий коммитит транзакцию"""
+    started, now = time.perf_counter(), dt.datetime.now(dt.UTC)
+    write = await bulk_writer(session, kind.model)
+    tree = await activity_tree.ensure(session) if kind.model is OrganizationActivity else None
+    total = imported = rejected = 0
+    errors: list[dict] = []
+
+    def reject(line: int, detail: str):
+        nonlocal rejected
+        rejected += 1
+        if len(errors) < MAX_ERRORS:
+            errors.append({"line": line, "detail": detail})
+
+    while chunk := list(islice(rows, IMPORT_CHUNK)):
+        total += len(chunk)
+        valid = []
+        for line, row in chunk:
+            if isinstance(row, str):
+                reject(line, row)
+                continue
+            try:
+                valid.append((line, kind.row.model_validate(row)))
+            except ValidationError as e:
+                reject(line, _error_text(e))
+
+        missing: dict[int, str] = {}
+        for field, model in kind.references.items():
+            ids = {getattr(item, field) for _, item in valid}
+            found = set(await session.scalars(select(model.id).where(model.id.in_(ids)))) if ids else set()
+            missing.update((line, f"{field}: запись не найдена")
+                           for line, item in valid if getattr(item, field) not in found)
+        if tree is not None:
+            missing.update((line, error.detail) for line, item in valid
+                           if line not in missing and (error := activity_error(tree, item.activity_id)))
+
+        records = []
+        for line, item in valid:
+            if line in missing:
+                reject(line, missing[line])
+            else:
+                records.append((line, kind.model.record(now, **item.model_dump())))
+
+        # запись не должна совпасть с уже записанной или с соседней строкой файла
+        columns = [getattr(kind.model, column) for column in kind.unique]
+        firsts = {record[kind.unique[0]] for _, record in records}
+        taken = set((await session.execute(select(*columns).where(columns[0].in_(firsts)))).tuples()) if firsts else set()
+        unique = []
+        for line, record in records:
+            if (key := tuple(record[column] for column in kind.unique)) in taken:
+                reject(line, f"{', '.join(kind.unique)}: запись уже существует")
+            else:
+                taken.add(key)
+                unique.append((line, record))
+        records = unique
+
+        if records:
+            await write([record for _, record in records])
+            imported += len(records)
+
+    mark_changed(session.sync_session, kind.model.__tablename__)  # COPY идёт мимо событий ORM
+    seconds = time.perf_counter() - started
+    return {"rows": total, "imported": imported, "rejected": rejected,
+            "seconds": round(seconds, 3), "rows_per_second": round(total / seconds, 1) if seconds else 0.0,
+            "errors": errors}
+
+
+@router.post("/{kind}/",
+             response_model=ImportReportDTO,
+             dependencies=[Security(verify_api_key)])
+async def import_file(
+        kind: str = Path(..., description=f"Что загружается: {', '.join(KINDS)}"),
+        file: UploadFile = File(..., description="CSV с заголовком или NDJSON, поля - как у строк импорта"),
+        session: AsyncSession = Depends(get_db)
+) -> dict:
+    """Загрузка справочника одной транзакцией: здания, затем организации, затем телефоны и виды деятельности"""
+    if kind not in KINDS:
+        raise HTTPException(status_code=404, detail=f"Неизвестный вид импорта: {kind}")
+    report = await import_rows(session, KINDS[kind], _read_rows(file))
+    await session.commit()
+    return {"kind": kind, **report}
@@ -1,128 +1,464 @@
 import datetime as dt
 import logging
-from typing import List
+from itertools import islice
+from typing import AsyncIterator, Awaitable, Callable, Iterator, List, Optional
 from uuid import UUID
 
-from fastapi import APIRouter, Depends, HTTPException, Response, Security
-from geopy.distance import geodesic
-from sqlalchemy import select
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, Response, Security
+from sqlalchemy import Select, and_, delete, func, insert, literal, or_, select
 from sqlalchemy.ext.asyncio import AsyncSession
 from uuid6 import uuid7
 
-from .depends import validate_activity_level, verify_api_key
-from .dto import GeoSearchDTO, OrganizationCreateDTO, OrganizationDTO, OrganizationUpdateDTO
+from .cache import CachedRoute
+from .cursor import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor
+from .depends import activities_error, parse_include, validate_activity_level, verify_api_key
+from .dto import (ActivityDTO, ActivityFacetDTO, ActivityFilterDTO, BuildingDTO, BulkResultDTO, FacetSearchDTO,
+                  GeoSearchDTO, NameCompletionDTO, NearestSearchDTO, OrganizationBulkDTO, OrganizationCreateDTO,
+                  OrganizationDistanceDTO, OrganizationDTO, OrganizationUpdateDTO, PhoneDTO, TileDTO)
+from .etag import conditional
+from .fast import fast_json, projection
+from .stream import NDJSON_RESPONSES, accepts_ndjson, ndjson_response
+from ..core.config import settings
+from ..core.geo import Box, Polygon, bounding_boxes, distances_km, points_in_polygon, polygon_box
+from ..core.search import normalize
+from ..db.activities import activity_tree
+from ..db.bitmaps import activity_bitmaps
+from ..db.facets import activity_facets
+from ..db.memory import mark_changed, sync_changes
 from ..db.models import Activity, Building, Organization, OrganizationActivity, OrganizationPhone
+from ..db.names import name_index
 from ..db.session import get_db
+from ..db.spatial import spatial_index
+from ..db.tiles import MAX_ZOOM, tile_index
 
-router = APIRouter(prefix="/organizations", tags=["Organizations"])
+# каждый запрос сначала подхватывает изменения других воркеров - до проверки ETag и кэша
+router = APIRouter(prefix="/organizations", tags=["Organizations"], route_class=CachedRoute,
+                   dependencies=[Depends(sync_changes)])
 
 logger = logging.getLogger(__name__)
 
+STREAM_BATCH = 100  # зданий на запрос при потоковой выдаче по радиусу, строк на проверку многоугольниками
+IN_CHUNK = 1000  # id в одном IN - выборка без limit читается частями, ниже предела параметров запроса
+
+
+def _keyset(stmt: Select, after: Optional[UUID], limit: Optional[int]) -> Select:
+    """Страница запроса организаций по возрастанию id (UUIDv7 - в порядке создания):
+    только записи после after и на одну больше limit - по лишней видно, что есть следующая страница"""
+    if after is not None:
+        stmt = stmt.where(Organization.id > after)
+    stmt = stmt.order_by(Organization.id)
+    return stmt.limit(limit + 1) if limit else stmt
+
+
+def _page(response: Response, organizations: List[dict], limit: Optional[int],
+          key: Callable[[dict], tuple] = lambda org: (org["id"],)) -> List[dict]:
+    """Обрезает выборку до limit и, если записи остались, отдаёт курсор следующей страницы в заголовке"""
+    if limit and len(organizations) > limit:
+        organizations = organizations[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(*key(organizations[-1]))
+    return organizations
+
+
+def _after(cursor: Optional[str]) -> Optional[UUID]:
+    return decode_cursor(cursor, UUID)[0] if cursor else None
+
+
+def _stream(stmt: Select) -> Callable[[AsyncSession], AsyncIterator[dict]]:
+    """Организации запроса по мере чтения серверным курсором - для потоковой выдачи"""
+    async def rows(session: AsyncSession) -> AsyncIterator[dict]:
+        convert = Organization.converter()
+        async for row in await session.stream(stmt):
+            yield convert(row)
+    return rows
+
+
+RELATIONS = {"phones": "phone_numbers", "activities": "activities", "building": "building"}  # include -> relationship
+
+
+async def _expand(session: AsyncSession, organizations: List[dict], include: frozenset[str]) -> List[dict]:
+    """Добавляет к организациям связанные данные из include: по одному запросу на связь для всех организаций,
+    виды деятельности берутся из дерева в памяти"""
+    if not include or not organizations:
+        return organizations
+    await Organization.load_related(session, organizations, *(RELATIONS[name] for name in sorted(include)))
+    tree = await activity_tree.ensure(session)
+    phone, activity, building = projection(PhoneDTO), projection(ActivityDTO), projection(BuildingDTO)
+    for org in organizations:
+        if "phones" in include:
+            org["phone_numbers"] = [phone(row) for row in org["phone_numbers"]]
+        if "activities" in include:
+            nodes = (tree.get(link["activity_id"]) for link in org["activities"])
+            org["activities"] = [activity(node._asdict()) for node in nodes if node is not None]
+        if "building" in include and org["building"] is not None:
+            org["building"] = building(org["building"])
+    return organizations
+
+
+def _prepare(include: frozenset[str]) -> Optional[Callable[[AsyncSession, List[dict]], Awaitable[List[dict]]]]:
+    """_expand для потоковой выдачи - вызывается на каждую пачку записей"""
+    return (lambda session, organizations: _expand(session, organizations, include)) if include else None
+
+
+async def _iter_by_distance(session: AsyncSession,
+                            nearest: Iterator[tuple[UUID, float]],
+                            batch: Optional[int] = None,
+                            after: Optional[tuple[float, UUID]] = None) -> AsyncIterator[dict]:
+    """Организации зданий из nearest (идут по возрастанию расстояния) по возрастанию (расстояния, id)
+    после курсора after. Здания берутся из nearest пачками по batch (без него - по STREAM_BATCH) - запрос в БД на пачку"""
+    if after:
+        nearest = ((building_id, distance) for building_id, distance in nearest if distance >= after[0])
+    while distances := dict(islice(nearest, batch or STREAM_BATCH)):
+        stmt = Organization.select_fields().where(Organization.building_id.in_(distances))
+        organizations = sorted(
+            ({**org, "distance_km": distances[org["building_id"]]} for org in await Organization.read(session, stmt)),
+            key=lambda org: (org["distance_km"], org["id"]),
+        )
+        for org in organizations:
+            if not after or (org["distance_km"], org["id"]) > after:
+                yield org
+
+
+async def _organizations_by_distance(session: AsyncSession,
+                                     nearest: Iterator[tuple[UUID, float]],
+                                     limit: Optional[int] = None,
+                                     after: Optional[tuple[float, UUID]] = None) -> List[dict]:
+    """Первые limit организаций из _iter_by_distance; здания берутся пачками по limit (без него - по STREAM_BATCH)"""
+    organizations = []
+    rows = _iter_by_distance(session, nearest, limit, after)
+    async for org in rows:
+        organizations.append(org)
+        if limit and len(organizations) >= limit:
+            await rows.aclose()
+            break
+    return organizations
+
+
+def _in_boxes(boxes: List[Box], after: Optional[UUID] = None, limit: Optional[int] = None) -> Select:
+    """Организации зданий внутри прямоугольников с координатами здания, здания отбираются по индексу geohash.
+    По возрастанию id, после after, страница limit"""
+    return _keyset(
+        Organization.select_fields(Building.latitude, Building.longitude)
+        .join(Building, Organization.building_id == Building.id)
+        .where(or_(*(Building.in_box(*box) for box in boxes))),
+        after, limit,
+    )
+
+
+def _in_polygons(points: List[tuple[float, float]], polygons: List[Polygon]) -> np.ndarray:
+    """Попадание точек хотя бы в один из многоугольников"""
+    inside = np.zeros(len(points), dtype=bool)
+    for polygon in polygons:
+        inside |= points_in_polygon(points, polygon)
+    return inside
+
 
 @router.get("/by_building/{building_id}/",
             response_model=List[OrganizationDTO],
-            dependencies=[Security(verify_api_key)])
+            responses=NDJSON_RESPONSES,
+            dependencies=[Security(verify_api_key), Depends(conditional(Organization))])
 async def get_organizations_by_building(
         response: Response,
         building_id: UUID,
+        limit: Optional[int] = Query(None, ge=1, le=1000),
+        after: Optional[str] = None,
+        ndjson: bool = Depends(accepts_ndjson),
+        include: frozenset[str] = Depends(parse_include),
         session: AsyncSession = Depends(get_db)
 ) -> List[dict]:
     """Cписок всех организаций находящихся в конкретном здании"""
-    stmt = select(Organization).where(
+    stmt = Organization.select_fields().where(
         Organization.building_id == building_id,
     )
-    result = await session.execute(stmt)
-    if not (organizations := result.scalars().all()):
+    if ndjson:
+        return await ndjson_response(_stream(_keyset(stmt, _after(after), None)), OrganizationDTO,
+                                     "В здании не найдены организации", limit, _prepare(include))
+    if not (organizations := await Organization.read(session, _keyset(stmt, _after(after), limit))):
         raise HTTPException(status_code=404, detail="В здании не найдены организации")
     response.status_code = 200
-    return [org.fields() for org in organizations]
+    organizations = await _expand(session, _page(response, organizations, limit), include)
+    return fast_json(response, OrganizationDTO, organizations)
 
 
 @router.get("/by_activity/{activity_id}/",
             response_model=List[OrganizationDTO],
-            dependencies=[Security(verify_api_key)])
+            responses=NDJSON_RESPONSES,
+            dependencies=[Security(verify_api_key), Depends(conditional(Organization, OrganizationActivity, Activity))])
 async def get_organizations_by_activity(
         response: Response,
         activity_id: UUID,
+        limit: Optional[int] = Query(None, ge=1, le=1000),
+        after: Optional[str] = None,
+        ndjson: bool = Depends(accepts_ndjson),
+        include: frozenset[str] = Depends(parse_include),
         session: AsyncSession = Depends(get_db)
 ) -> List[dict]:
     """Список всех организаций, которые относятся к указанному виду деятельности"""
     await validate_activity_level(activity_id, session)
     stmt = (
-        select(Organization)
+        Organization.select_fields()
         .join(OrganizationActivity, Organization.id == OrganizationActivity.organization_id)
         .where(OrganizationActivity.activity_id == activity_id)
     )
-    result = await session.execute(stmt)
-    organizations = result.scalars().all()
+    if ndjson:
+        return await ndjson_response(_stream(_keyset(stmt, _after(after), None)), OrganizationDTO,
+                                     "Не найдено организации по активности", limit, _prepare(include))
+    organizations = await Organization.read(session, _keyset(stmt, _after(after), limit))
     if not organizations:
         raise HTTPException(status_code=404, detail="Не найдено организации по активности")
     response.status_code = 200
-    return [org.fields() for org in organizations]
+    organizations = await _expand(session, _page(response, organizations, limit), include)
+    return fast_json(response, OrganizationDTO, organizations)
 
 
-@router.post("/by_geo/",
+@router.post("/by_activities/",
              response_model=List[OrganizationDTO],
              dependencies=[Security(verify_api_key)])
+async def get_organizations_by_activities(
+        response: Response,
+        dto: ActivityFilterDTO,
+        include: frozenset[str] = Depends(parse_include),
+        session: AsyncSession = Depends(get_db)
+) -> List[dict]:
+    """Организации, отобранные по нескольким видам деятельности: все из all_of, любой из any_of, ни одного из none_of"""
+    if not (dto.all_of or dto.any_of):
+        raise HTTPException(status_code=400, detail="Укажите all_of или any_of")
+    for activity_id in {*dto.all_of, *dto.any_of, *dto.none_of}:
+        await validate_activity_level(activity_id, session)
+
+    tree = await activity_tree.ensure(session)
+    expand = (
+        (lambda activity_id: tree.subtree(activity_id, max_level=settings.ACTIVITY_MAX_LEVEL))
+        if dto.include_subtree else (lambda activity_id: [activity_id])
+    )
+    index = await activity_bitmaps.ensure(session)
+    organization_ids = index.query(
+        all_of=[expand(activity_id) for activity_id in dto.all_of],
+        any_of=[node_id for activity_id in dto.any_of for node_id in expand(activity_id)],
+        none_of=[node_id for activity_id in dto.none_of for node_id in expand(activity_id)],
+    )
+    # страница выбирается по id из индекса - в БД уходят только её записи
+    if after := _after(dto.after):
+        organization_ids = [organization_id for organization_id in organization_ids if organization_id > after]
+    organization_ids = sorted(organization_ids)[:dto.limit + 1 if dto.limit else None]
+    if not organization_ids:
+        raise HTTPException(status_code=404, detail="Не найдено организации по активности")
+    organizations = []
+    for start in range(0, len(organization_ids), IN_CHUNK):
+        chunk = organization_ids[start:start + IN_CHUNK]
+        stmt = Organization.select_fields().where(Organization.id.in_(chunk)).order_by(Organization.id)
+        organizations.extend(await Organization.read(session, stmt))
+    response.status_code = 200
+    organizations = await _expand(session, _page(response, organizations, dto.limit), include)
+    return fast_json(response, OrganizationDTO, organizations)
+
+
+@router.post("/by_geo/",
+             response_model=List[OrganizationDistanceDTO],
+             responses=NDJSON_RESPONSES,
+             dependencies=[Security(verify_api_key)])
 async def get_organizations_by_geo(
         response: Response,
         dto: GeoSearchDTO,
+        ndjson: bool = Depends(accepts_ndjson),
+        include: frozenset[str] = Depends(parse_include),
         session: AsyncSession = Depends(get_db)
 ) -> List[dict]:
-    """Cписок организаций, которые находятся в заданном радиусе/прямоугольной области
-    относительно указанной точки на карте. список зданий"""
+    """Cписок организаций, которые находятся в заданном радиусе/прямоугольной области/многоугольниках
+    относительно указанной точки на карте. список зданий.
+    По радиусу - по возрастанию расстояния и с distance_km, иначе - по возрастанию id; постранично (limit/after)"""
+    not_found = "Не найдены здания в заданной области"
+    if dto.radius_km is not None and (dto.limit or dto.after or ndjson):
+        # страница ближайших: обходим здания из индекса по возрастанию расстояния и останавливаемся на limit
+        index = await spatial_index.ensure(session)
+        after = decode_cursor(dto.after, float, UUID) if dto.after else None
+        nearest = index.nearest(dto.latitude, dto.longitude, dto.accuracy, max_km=dto.radius_km,
+                                start_km=max(after[0], 1.0) if after else 1.0)
+        if ndjson:
+            return await ndjson_response(lambda stream: _iter_by_distance(stream, nearest, STREAM_BATCH, after),
+                                         OrganizationDistanceDTO, not_found, dto.limit, _prepare(include))
+        limit = dto.limit + 1 if dto.limit else None  # лишняя запись - признак следующей страницы
+        organizations = await _organizations_by_distance(session, nearest, limit, after)
+        if not organizations:  # как и без страниц: нет зданий или в найденных зданиях нет организаций
+            raise HTTPException(status_code=404, detail=not_found)
+        response.status_code = 200
+        organizations = _page(response, organizations, dto.limit, key=lambda org: (org["distance_km"], org["id"]))
+        await _expand(session, organizations, include)
+        return fast_json(response, OrganizationDistanceDTO, organizations)
+
+    polygons = [[(point.latitude, point.longitude) for point in polygon] for polygon in dto.polygons or []]
     if dto.radius_km is not None:
-        result = await session.execute(select(Building))
-        buildings = result.scalars().all()
-        valid_building_ids = []
-        center = (dto.latitude, dto.longitude)
-        for building in buildings:
-            building_loc = (building.latitude, building.longitude)
-            distance = geodesic(center, building_loc).kilometers
-            if distance <= dto.radius_km:
-                valid_building_ids.append(building.id)
+        boxes = bounding_boxes(dto.latitude, dto.longitude, dto.radius_km, dto.accuracy)
+    elif polygons:
+        boxes = [polygon_box(polygon) for polygon in polygons]
     elif all([dto.lat_min, dto.lat_max, dto.lon_min, dto.lon_max]):
-        stmt = select(Building).where(
-            Building.latitude.between(dto.lat_min, dto.lat_max),
-            Building.longitude.between(dto.lon_min, dto.lon_max),
+        boxes = [(dto.lat_min, dto.lat_max, dto.lon_min, dto.lon_max)]
+    else:
+        raise HTTPException(status_code=400, detail="Provide either radius_km, polygons or all rectangular coordinates")
+
+    convert = Organization.converter()  # строка _in_boxes: колонки организации, широта, долгота здания
+    if dto.radius_km is not None:
+        rows = (await session.execute(_in_boxes(boxes))).all()
+        points = [(row[-2], row[-1]) for row in rows]
+        distances = distances_km(dto.latitude, dto.longitude, points, dto.accuracy)
+        organizations = sorted(
+            ({**convert(row), "distance_km": distance} for row, distance in zip(rows, distances, strict=True)
+             if distance <= dto.radius_km),
+            key=lambda org: (org["distance_km"], org["id"]),
         )
-        result = await session.execute(stmt)
-        valid_building_ids = [b.id for b in result.scalars().all()]
+    elif ndjson:
+        async def in_area(stream: AsyncSession) -> AsyncIterator[dict]:
+            # многоугольники проверяются пачками по STREAM_BATCH строк - одним вызовом на пачку
+            async for rows in (await stream.stream(_in_boxes(boxes, _after(dto.after)))).partitions(STREAM_BATCH):
+                matched = _in_polygons([(row[-2], row[-1]) for row in rows], polygons) if polygons else [True] * len(rows)
+                for row, match in zip(rows, matched, strict=True):
+                    if match:
+                        yield convert(row)
+        return await ndjson_response(in_area, OrganizationDistanceDTO, not_found, dto.limit, _prepare(include))
     else:
-        raise HTTPException(status_code=400, detail="Provide either radius_km or all rectangular coordinates")
+        # прямоугольник и многоугольники - по возрастанию id; многоугольники отсеивают часть строк,
+        # поэтому страницу добираем следующими пачками
+        after, organizations = _after(dto.after), []
+        while True:
+            rows = (await session.execute(_in_boxes(boxes, after, dto.limit))).all()
+            matched = _in_polygons([(row[-2], row[-1]) for row in rows], polygons) if polygons else [True] * len(rows)
+            organizations.extend(convert(row) for row, match in zip(rows, matched, strict=True) if match)
+            if not dto.limit or len(rows) <= dto.limit or len(organizations) > dto.limit:
+                break
+            after = rows[-1].id
+
+    if not organizations:
+        raise HTTPException(status_code=404, detail=not_found)
+    response.status_code = 200
+    organizations = await _expand(session, _page(response, organizations, dto.limit), include)
+    return fast_json(response, OrganizationDistanceDTO, organizations)
 
-    if not valid_building_ids:
-        raise HTTPException(status_code=404, detail="Не найдены здания в заданной области")
 
-    stmt = select(Organization).where(Organization.building_id.in_(valid_building_ids))
-    result = await session.execute(stmt)
-    organizations = result.scalars().all()
+@router.post("/nearest/",
+             response_model=List[OrganizationDistanceDTO],
+             dependencies=[Security(verify_api_key)])
+async def get_nearest_organizations(
+        response: Response,
+        dto: NearestSearchDTO,
+        include: frozenset[str] = Depends(parse_include),
+        session: AsyncSession = Depends(get_db)
+) -> List[dict]:
+    """k ближайших к точке организаций с расстоянием до них в км"""
+    index = await spatial_index.ensure(session)
+    nearest = index.nearest(dto.latitude, dto.longitude, dto.accuracy)
+    if not (organizations := await _organizations_by_distance(session, nearest, dto.k)):
+        raise HTTPException(status_code=404, detail="Не найдены организации")
     response.status_code = 200
-    return [org.fields() for org in organizations]
+    organizations = await _expand(session, organizations[:dto.k], include)
+    return fast_json(response, OrganizationDistanceDTO, organizations)
+
+
+@router.post("/facets/",
+             response_model=List[ActivityFacetDTO],
+             dependencies=[Security(verify_api_key)])
+async def get_activity_facets(
+        response: Response,
+        dto: FacetSearchDTO,
+        session: AsyncSession = Depends(get_db)
+) -> List[dict]:
+    """Число организаций в поддереве каждого вида деятельности (как в by_activity_tree),
+    по всему каталогу, в здании и/или в области"""
+    building_ids = None
+    if dto.radius_km is not None or dto.polygons or dto.lat_min is not None:
+        index = await spatial_index.ensure(session)
+        if dto.radius_km is not None:
+            if dto.latitude is None or dto.longitude is None:
+                raise HTTPException(status_code=400, detail="Для поиска по радиусу нужны latitude и longitude")
+            building_ids = set(index.distances(dto.latitude, dto.longitude, dto.radius_km, dto.accuracy))
+        elif dto.polygons:
+            building_ids = set()
+            for polygon in ([(point.latitude, point.longitude) for point in polygon] for polygon in dto.polygons):
+                candidates = list(index.in_box(*polygon_box(polygon)))
+                inside = points_in_polygon([(lat, lon) for _, lat, lon in candidates], polygon)
+                building_ids.update(building_id for (building_id, *_), matched in zip(candidates, inside, strict=True) if matched)
+        elif None not in (dto.lat_min, dto.lat_max, dto.lon_min, dto.lon_max):
+            building_ids = {building_id for building_id, *_ in index.in_box(dto.lat_min, dto.lat_max,
+                                                                            dto.lon_min, dto.lon_max)}
+        else:
+            raise HTTPException(status_code=400,
+                                detail="Provide either radius_km, polygons or all rectangular coordinates")
+    if dto.building_id is not None:
+        building_ids = {dto.building_id} & building_ids if building_ids is not None else {dto.building_id}
+
+    tree = await activity_tree.ensure(session)
+    facets = await activity_facets.ensure(session)
+    counts = facets.counts(building_ids)
+    response.status_code = 200
+    return [
+        {**node._asdict(), "count": counts[node.id]}
+        for node in tree.nodes(max_level=settings.ACTIVITY_MAX_LEVEL)
+    ]
+
+
+@router.get("/tiles/{z}/{x}/{y}/",
+            response_model=TileDTO,
+            dependencies=[Security(verify_api_key)])
+async def get_organizations_tile(
+        response: Response,
+        z: int = Path(..., ge=0, le=MAX_ZOOM),
+        x: int = Path(..., ge=0),
+        y: int = Path(..., ge=0),
+        session: AsyncSession = Depends(get_db)
+) -> dict:
+    """Кластеры организаций для тайла карты z/x/y (Web Mercator):
+    число организаций и их центроид в ячейках 8x8 внутри тайла"""
+    if x >= 1 << z or y >= 1 << z:
+        raise HTTPException(status_code=400, detail="Тайл вне сетки масштаба")
+    index = await tile_index.ensure(session)
+    cells = index.tile(z, x, y)
+    response.status_code = 200
+    return {"z": z, "x": x, "y": y, "count": sum(cell["count"] for cell in cells), "cells": cells}
+
+
+@router.get("/autocomplete/",
+            response_model=List[NameCompletionDTO],
+            dependencies=[Security(verify_api_key)])
+async def autocomplete_organization_names(
+        response: Response,
+        q: str = Query(..., min_length=1),
+        limit: int = Query(10, ge=1, le=50),
+        session: AsyncSession = Depends(get_db)
+) -> List[dict]:
+    """Подсказки названий организаций по началу слова - из индекса в памяти, без запроса в БД"""
+    index = await name_index.ensure(session)
+    response.status_code = 200
+    return index.complete(q, limit)
 
 
 @router.get("/{organization_id}/",
             response_model=OrganizationDTO,
-            dependencies=[Security(verify_api_key)])
+            dependencies=[Security(verify_api_key), Depends(conditional(Organization))])
 async def get_organization_by_id(
         response: Response,
         organization_id: UUID,
+        include: frozenset[str] = Depends(parse_include),
         session: AsyncSession = Depends(get_db)
 ) -> dict:
     """Вывод информации об организации по её идентификатору"""
-    organization = await session.get(Organization, organization_id)
-    if not organization:
+    stmt = Organization.select_fields().where(Organization.id == organization_id)
+    if not (organizations := await Organization.read(session, stmt)):
         raise HTTPException(status_code=404, detail="Организация не найдена")
     response.status_code = 200
-    return organization.fields()
+    await _expand(session, organizations, include)
+    return fast_json(response, OrganizationDTO, organizations[0])
 
 
 @router.get("/by_activity_tree/{activity_id}/",
             response_model=List[OrganizationDTO],
-            dependencies=[Security(verify_api_key)])
+            responses=NDJSON_RESPONSES,
+            dependencies=[Security(verify_api_key), Depends(conditional(Organization, OrganizationActivity, Activity))])
 async def get_organizations_by_activity_tree(
         response: Response,
         activity_id: UUID,
+        limit: Optional[int] = Query(None, ge=1, le=1000),
+        after: Optional[str] = None,
+        ndjson: bool = Depends(accepts_ndjson),
+        include: frozenset[str] = Depends(parse_include),
         session: AsyncSession = Depends(get_db)
 ) -> List[dict]:
     """Искать организации по виду деятельности.
@@ -132,47 +468,62 @@ async def get_organizations_by_activity_tree(
     Еда, Мясная продукция, Молочная продукция"""
     await validate_activity_level(activity_id, session)
 
-    activity_ids = [activity_id]
-    current_level = 1
-    while current_level < 3:
-        stmt = select(Activity.id).where(
-            Activity.parent_id.in_(activity_ids),
-            Activity.level <= 3,
-        )
-        result = await session.execute(stmt)
-        if not (child_ids := result.scalars().all()):
-            break
-        activity_ids.extend(child_ids)
-        current_level += 1
-
+    tree = await activity_tree.ensure(session)
+    activity_ids = tree.subtree(activity_id, max_level=settings.ACTIVITY_MAX_LEVEL)
     stmt = (
-        select(Organization)
+        Organization.select_fields()
         .join(OrganizationActivity, Organization.id == OrganizationActivity.organization_id)
         .where(OrganizationActivity.activity_id.in_(activity_ids))
         .distinct()
     )
-    result = await session.execute(stmt)
-    if not (organizations := result.scalars().all()):
+    if ndjson:
+        return await ndjson_response(_stream(_keyset(stmt, _after(after), None)), OrganizationDTO,
+                                     "Не найдена организация по активности", limit, _prepare(include))
+    if not (organizations := await Organization.read(session, _keyset(stmt, _after(after), limit))):
         raise HTTPException(status_code=404, detail="Не найдена организация по активности")
     response.status_code = 200
-    return [org.fields() for org in organizations]
+    organizations = await _expand(session, _page(response, organizations, limit), include)
+    return fast_json(response, OrganizationDTO, organizations)
 
 
 @router.get("/by_name/{name}/",
             response_model=List[OrganizationDTO],
-            dependencies=[Security(verify_api_key)])
+            dependencies=[Security(verify_api_key), Depends(conditional(Organization))])
 async def get_organizations_by_name(
         response: Response,
         name: str,
+        limit: int = Query(20, ge=1, le=100),
+        after: Optional[str] = None,
+        include: frozenset[str] = Depends(parse_include),
         session: AsyncSession = Depends(get_db)
 ) -> List[dict]:
-    """Поиск организации по названию"""
-    stmt = select(Organization).where(Organization.name.ilike(f"%{name}%"))
+    """Поиск организации по названию: вхождение строки или похожее слово (опечатки),
+    без учёта регистра и ё. Сначала самые похожие, курсор - (похожесть, id)"""
+    if not (query := normalize(name)):
+        raise HTTPException(status_code=404, detail="Не найдена организация по названию")
+    search_name = Organization.search_name
+    rank = func.word_similarity(query, search_name)
+    stmt = (
+        Organization.select_fields(rank)
+        .where(or_(
+            search_name.contains(query, autoescape=True),
+            literal(query).op("<%")(search_name),  # word_similarity >= NAME_SIMILARITY_THRESHOLD
+        ))
+        .order_by(rank.desc(), Organization.id)
+        .limit(limit + 1)
+    )
+    if after:
+        after_rank, after_id = decode_cursor(after, float, UUID)
+        stmt = stmt.where(or_(rank < after_rank, and_(rank == after_rank, Organization.id > after_id)))
     result = await session.execute(stmt)
-    if not (organizations := result.scalars().all()):
+    if not (rows := result.all()):
         raise HTTPException(status_code=404, detail="Не найдена организация по названию")
     response.status_code = 200
-    return [org.fields() for org in organizations]
+    convert = Organization.converter()
+    organizations = [{**convert(row), "rank": row[-1]} for row in rows]
+    organizations = _page(response, organizations, limit, key=lambda org: (org["rank"], org["id"]))
+    await _expand(session, organizations, include)
+    return fast_json(response, OrganizationDTO, organizations)
 
 
 @router.post("/",
@@ -181,6 +532,7 @@ async def get_organizations_by_name(
 async def create_organization(
         response: Response,
         dto: OrganizationCreateDTO,
+        include: frozenset[str] = Depends(parse_include),
         session: AsyncSession = Depends(get_db)
 ) -> dict:
     if not (building := await session.get(Building, dto.building_id)):
@@ -217,7 +569,77 @@ async def create_organization(
 
     await session.commit()
     response.status_code = 201
-    return organization.fields()
+    return (await _expand(session, [organization.fields()], include))[0]
+
+
+@router.post("/bulk/",
+             response_model=BulkResultDTO,
+             dependencies=[Security(verify_api_key)])
+async def create_organizations_bulk(
+        response: Response,
+        dto: OrganizationBulkDTO,
+        session: AsyncSession = Depends(get_db)
+) -> dict:
+    """Создание многих организаций одной транзакцией. Здания проверяются одним запросом,
+    виды деятельности - по дереву в памяти, строки вставляются многострочными INSERT.
+    Организация с ошибкой не создаётся и не мешает остальным: результат - по каждой, в порядке запроса.
+    201 - созданы все, 207 - часть с ошибками"""
+    buildings = set(await session.scalars(
+        select(Building.id).where(Building.id.in_({item.building_id for item in dto.organizations}))
+    ))
+    tree = await activity_tree.ensure(session)
+    now = dt.datetime.now(dt.UTC)
+    items, organizations, phones, activities = [], [], [], []
+    for index, item in enumerate(dto.organizations):
+        if item.building_id not in buildings:
+            error = HTTPException(status_code=404, detail="Здание не найдено")
+        else:
+            error = activities_error(tree, item.activity_ids)
+        if error:
+            items.append({"index": index, "status": error.status_code, "detail": error.detail})
+            continue
+        organization = Organization.record(now, name=item.name, building_id=item.building_id)
+        organization_id = organization["id"]
+        organizations.append(organization)
+        phones.extend(OrganizationPhone.record(now, organization_id=organization_id, phone_number=phone)
+                      for phone in item.phone_numbers)
+        activities.extend(OrganizationActivity.record(now, organization_id=organization_id, activity_id=activity_id)
+                          for activity_id in dict.fromkeys(item.activity_ids))
+        items.append({"index": index, "status": 201, "id": organization_id})
+
+    for model, rows in ((Organization, organizations), (OrganizationPhone, phones),
+                        (OrganizationActivity, activities)):
+        if rows:
+            await session.execute(insert(model), rows)
+    await session.commit()
+    response.status_code = 201 if len(organizations) == len(items) else 207
+    return {"created": len(organizations), "failed": len(items) - len(organizations), "items": items}
+
+
+async def _sync_links(session: AsyncSession, model: type, organization_id: UUID, column: str, values: list):
+    """Приводит связи организации к набору values по разнице с сохранёнными: одним DELETE лишних
+    (и повторных) строк и одним многострочным INSERT недостающих. Запросы идут мимо ORM,
+    поэтому индексам сообщается только id организации - они перечитают её одну"""
+    table = model.__table__
+    stored = await session.execute(select(table.c.id, table.c[column]).where(table.c.organization_id == organization_id))
+    wanted, kept, stale = dict.fromkeys(values), set(), []
+    for row_id, value in stored:
+        if value in wanted and value not in kept:
+            kept.add(value)
+        else:
+            stale.append(row_id)
+    added = [value for value in wanted if value not in kept]
+    if not (stale or added):
+        return
+    connection = await session.connection()
+    if stale:
+        await connection.execute(delete(table).where(table.c.id.in_(stale)))
+    if added:
+        now = dt.datetime.now(dt.UTC)
+        await connection.execute(insert(table), [
+            model.record(now, organization_id=organization_id, **{column: value}) for value in added
+        ])
+    mark_changed(session.sync_session, table.name, keys=[organization_id])
 
 
 @router.patch("/{organization_id}/",
@@ -227,12 +649,16 @@ async def update_organization(
         response: Response,
         organization_id: UUID,
         dto: OrganizationUpdateDTO,
+        include: frozenset[str] = Depends(parse_include),
         session: AsyncSession = Depends(get_db)
 ) -> dict:
     if not (organization := await session.get(Organization, organization_id)):
         raise HTTPException(status_code=404, detail="Организация не найдена")
 
     update_data = dto.model_dump(exclude_unset=True)
+    if "activity_ids" in update_data:
+        if error := activities_error(await activity_tree.ensure(session), update_data["activity_ids"] or []):
+            raise error
 
     # Update main organization fields
     for field, value in update_data.items():
@@ -243,52 +669,16 @@ async def update_organization(
                     raise HTTPException(status_code=404, detail="Здание не найдено")
             setattr(organization, field, value)
 
-    # Update phone numbers
+    # Телефоны и виды деятельности заменяются переданным списком
     if "phone_numbers" in update_data:
-        # Mark existing phones as inactive
-        stmt = select(OrganizationPhone).where(
-            OrganizationPhone.organization_id == organization_id
-        )
-        result = await session.execute(stmt)
-        for phone in result.scalars().all():
-            session.add(phone)
-
-        # Add new phone numbers
-        for phone in update_data["phone_numbers"]:
-            phone_entry = OrganizationPhone(
-                organization_id=organization.id,
-                phone_number=phone,
-                created_at=dt.datetime.now(dt.UTC),
-            )
-            session.add(phone_entry)
-
-    # Update activities
+        await _sync_links(session, OrganizationPhone, organization_id, "phone_number", update_data["phone_numbers"] or [])
     if "activity_ids" in update_data:
-        # Validate new activities
-        for activity_id in update_data["activity_ids"]:
-            await validate_activity_level(activity_id, session)
-
-        # Mark existing activities as inactive
-        stmt = select(OrganizationActivity).where(
-            OrganizationActivity.organization_id == organization_id,
-        )
-        result = await session.execute(stmt)
-        for activity in result.scalars().all():
-            session.add(activity)
-
-        # Add new activities
-        for activity_id in update_data["activity_ids"]:
-            activity_entry = OrganizationActivity(
-                organization_id=organization.id,
-                activity_id=activity_id,
-                created_at=dt.datetime.now(dt.UTC),
-            )
-            session.add(activity_entry)
+        await _sync_links(session, OrganizationActivity, organization_id, "activity_id", update_data["activity_ids"] or [])
 
     session.add(organization)
     await session.commit()
     response.status_code = 200
-    return organization.fields()
+    return (await _expand(session, [organization.fields()], include))[0]
 
 
 @router.delete("/{organization_id}/",
@@ -297,11 +687,17 @@ async def update_organization(
 async def delete_organization(
         response: Response,
         organization_id: UUID,
+        include: frozenset[str] = Depends(parse_include),
         session: AsyncSession = Depends(get_db)
 ) -> dict:
     organization = await Organization.get_or_404(id=organization_id, session=session)
-    if not await Organization.delete_where(id=organization_id, session=session):
-        raise HTTPException(status_code=404, detail="Организация не найдена")
+    deleted = await _expand(session, [organization.fields()], include)  # связи удаляются вместе с организацией
+    # удаление через ORM: индексы перечитают только эту организацию и её здание;
+    # связи удаляет каскад в БД мимо ORM - о них сообщаем по id организации, как в _sync_links
+    await session.delete(organization)
+    mark_changed(session.sync_session, OrganizationPhone.__tablename__, OrganizationActivity.__tablename__,
+                 keys=[organization_id])
+    await session.commit()
 
     response.status_code = 200
-    return organization.fields()
+    return deleted[0]
@@ -0,0 +1,72 @@
+"""Потоковая выдача списков в формате NDJSON"""
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import Any
+
+from fastapi import Header, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from pydantic_core import to_json
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.config import settings
+from ..db.session import AsyncSessionLocal
+from .fast import projection
+
+NDJSON = "application/x-ndjson"
+CHUNK = 100  # записей, для которых связанные данные подгружаются одним запросом
+# описание альтернативного формата ответа для OpenAPI
+NDJSON_RESPONSES = {200: {"content": {NDJSON: {}}, "description": f"Список или поток {NDJSON} (Accept: {NDJSON})"}}
+
+
+def accepts_ndjson(accept: str | None = Header(None, include_in_schema=False)) -> bool:
+    """Клиент просит поток NDJSON заголовком Accept"""
+    return NDJSON in (accept or "")
+
+
+async def ndjson_response(rows: Callable[[AsyncSession], AsyncIterator[dict]],
+                          model: type[BaseModel],
+                          detail: str,
+                          limit: int | None = None,
+                          prepare: Callable[[AsyncSession, list[dict]], Awaitable[Any]] | None = None,
+                          ) -> StreamingResponse:
+    """Ответ NDJSON: по строке JSON на запись, записи отдаются по мере чтения из БД.
+    rows получает собственную сессию: сессия запроса закрывается до того, как начнёт отправляться тело.
+    prepare дополняет записи пачками по CHUNK (связанные данные). Пустая выборка - 404 с detail,
+    как у обычного ответа. Курсор следующей страницы не отдаётся - поток рассчитан на чтение выборки целиком,
+    limit лишь обрезает его"""
+    session = AsyncSessionLocal()
+    iterator = aiter(rows(session))
+    try:
+        first = await anext(iterator, None)
+    except Exception:
+        await session.close()
+        raise
+    if first is None:
+        await session.close()
+        raise HTTPException(status_code=404, detail=detail)
+
+    project = projection(model) if settings.FAST_JSON else None
+
+    def encode(row: dict) -> bytes:
+        if project is not None:
+            return to_json(project(row))
+        return model.model_validate(row).model_dump_json().encode()
+    chunk_size = CHUNK if prepare else 1
+
+    async def body() -> AsyncIterator[bytes]:
+        try:
+            sent, row = 0, first
+            while row is not None and (limit is None or sent < limit):
+                chunk = []
+                while row is not None and len(chunk) < chunk_size and (limit is None or sent + len(chunk) < limit):
+                    chunk.append(row)
+                    row = await anext(iterator, None)
+                if prepare:
+                    await prepare(session, chunk)
+                yield b"".join(encode(item) + b"\n" for item in chunk)
+                sent += len(chunk)
+        finally:
+            await iterator.aclose()
+            await session.close()
+
+    return StreamingResponse(body(), media_type=NDJSON)
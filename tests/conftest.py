@@ -1,14 +1,27 @@
 # Базовый URL для тестов
 import subprocess
 import time
+from uuid import UUID
 
 import pytest
 import requests
 from dotenv import load_dotenv
+from sqlalchemy import create_engine, delete
+
+from src.core.config import settings
+from src.db.models import Building
 
 BASE_URL = "http://127.0.0.1:8000"
 
 
+def delete_buildings(*building_ids: str):
+    """Удалить созданные тестом здания - API для удаления зданий нет, поэтому прямо в БД"""
+    engine = create_engine(settings.SQLALCHEMY_DATABASE_URI)
+    with engine.begin() as connection:
+        connection.execute(delete(Building).where(Building.id.in_([UUID(building_id) for building_id in building_ids])))
+    engine.dispose()
+
+
 @pytest.fixture(scope="session", autouse=True)
 def start_server():
     # Запускаем сервер
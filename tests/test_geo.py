@@ -0,0 +1,31 @@
+import math
+import random
+
+from geopy.distance import geodesic
+
+from src.core.geo import EARTH_RADIUS_KM, SPHERE_ERROR, distances_km, points_in_polygon
+
+
+def test_distances_km():
+    """Тест расстояний: exact совпадает с geopy в пределах миллиметров (и у почти антиподальных точек),
+    fast отличается от геодезической не больше чем на SPHERE_ERROR."""
+    rnd = random.Random(3)
+    center = (55.75, 37.6)
+    points = [(rnd.uniform(-90, 90), rnd.uniform(-180, 180)) for _ in range(2000)]
+    points += [center, (-55.75, -142.4), (-55.7, -142.35), (90.0, 0.0), (0.0, 180.0)]
+    expected = [geodesic(center, point).kilometers for point in points]
+
+    exact = distances_km(*center, points)
+    assert max(abs(a - e) for a, e in zip(exact, expected, strict=True)) < 1e-6
+    fast = distances_km(*center, points, "fast")
+    assert all(abs(f - e) <= SPHERE_ERROR * e + 1e-9 for f, e in zip(fast, expected, strict=True))
+    assert distances_km(0.0, 0.0, [(0.0, 180.0)], "fast") == [EARTH_RADIUS_KM * math.pi]
+    assert distances_km(*center, []) == distances_km(*center, [], "fast") == []
+
+
+def test_points_in_polygon():
+    """Тест попадания в невыпуклый многоугольник с горизонтальными рёбрами и пустого набора точек"""
+    polygon = [(0.0, 0.0), (0.0, 4.0), (4.0, 4.0), (4.0, 0.0), (2.0, 2.0)]
+    points = [(1.0, 3.0), (3.0, 3.0), (2.0, 1.0), (3.0, 0.5), (5.0, 2.0), (-1.0, 2.0)]
+    assert points_in_polygon(points, polygon).tolist() == [True, True, False, False, False, False]
+    assert points_in_polygon([], polygon).tolist() == []
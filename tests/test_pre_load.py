@@ -0,0 +1,28 @@
+import json
+
+import pytest
+
+from src.db.pre_load import iter_json_tables
+
+
+def test_iter_json_tables(tmp_path):
+    """Тест потокового чтения фикстур: при любом размере куска записи совпадают с json.load,
+    в том числе когда граница куска рвёт число, строку или пробелы между записями."""
+    data = {
+        "buildings": [{"id": "1", "address": "ул. Ленина, 1", "latitude": 55.7522, "longitude": 37.6156},
+                      {"id": "2", "address": "Проспект \"Мира\", 2", "latitude": -1e-7, "longitude": 123456789}],
+        "activities": [],
+        "organizations": [{"id": "3", "name": "ООО «Рога и Копыта»", "tags": [1, [2, {"a": None}]]}],
+    }
+    path = tmp_path / "fixtures.json"
+    path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    expected = [(table, row) for table, rows in data.items() for row in rows]
+    for chunk_size in [*range(1, 40), 1 << 16]:
+        assert list(iter_json_tables(str(path), chunk_size)) == expected
+
+    path.write_text(" { } ", encoding="utf-8")
+    assert list(iter_json_tables(str(path), 1)) == []
+
+    path.write_text('{"buildings": [{"id": 1}, 12', encoding="utf-8")
+    with pytest.raises(ValueError):
+        list(iter_json_tables(str(path), 4))
@@ -1,8 +1,9 @@
+import json
 import requests
-from uuid import UUID
+from uuid import UUID, uuid4
 
 from src.core.config import settings
-from .conftest import BASE_URL
+from .conftest import BASE_URL, delete_buildings
 
 # Предполагаемые ID из fixtures.json
 BUILDING_ID = "550e8400-e29b-41d4-a716-446655440001"
@@ -43,6 +44,31 @@ def test_get_organizations_by_activity():
     assert response.status_code == 404
 
 
+def test_get_organizations_by_activities():
+    """Тест отбора организаций по нескольким видам деятельности."""
+    payload = {"any_of": [ROOT_ACTIVITY_ID], "include_subtree": True}
+    response = requests.post(f"{BASE_URL}/organizations/by_activities/", json=payload, headers=HEADERS)
+    assert response.status_code == 200
+    food = {org["id"] for org in response.json()}
+    tree = requests.get(f"{BASE_URL}/organizations/by_activity_tree/{ROOT_ACTIVITY_ID}/", headers=HEADERS)
+    assert food == {org["id"] for org in tree.json()}
+
+    payload = {"all_of": [ROOT_ACTIVITY_ID, ACTIVITY_ID], "include_subtree": True}
+    response = requests.post(f"{BASE_URL}/organizations/by_activities/", json=payload, headers=HEADERS)
+    assert response.status_code == 200
+    assert ORGANIZATION_ID in [org["id"] for org in response.json()]
+
+    # Исключение вида деятельности
+    payload = {"any_of": [ROOT_ACTIVITY_ID], "none_of": [ACTIVITY_ID], "include_subtree": True}
+    response = requests.post(f"{BASE_URL}/organizations/by_activities/", json=payload, headers=HEADERS)
+    assert response.status_code == 200
+    assert {org["id"] for org in response.json()} < food
+    assert ORGANIZATION_ID not in [org["id"] for org in response.json()]
+
+    response = requests.post(f"{BASE_URL}/organizations/by_activities/", json={}, headers=HEADERS)
+    assert response.status_code == 400
+
+
 def test_get_organizations_by_geo_radius():
     """Тест получения организаций в радиусе от точки."""
     payload = {
@@ -65,6 +91,64 @@ def test_get_organizations_by_geo_radius():
     assert response.json()["detail"] == "Не найдены здания в заданной области"
 
 
+def test_get_organizations_by_geo_radius_empty_building():
+    """Тест поиска по радиусу, в котором есть только здание без организаций: 404 и со страницами, и без."""
+    building_id = str(uuid4())
+    building = json.dumps({"id": building_id, "address": "г. Пустой, ул. Безлюдная, 1", "latitude": -60.5, "longitude": 100.5})
+    requests.post(f"{BASE_URL}/import/buildings/", headers=HEADERS,
+                  files={"file": ("buildings.ndjson", building, "application/x-ndjson")})
+    payload = {"latitude": -60.5, "longitude": 100.5, "radius_km": 1.0}
+    try:
+        for extra in ({}, {"limit": 2}):
+            response = requests.post(f"{BASE_URL}/organizations/by_geo/", json={**payload, **extra}, headers=HEADERS)
+            assert response.status_code == 404
+            assert response.json()["detail"] == "Не найдены здания в заданной области"
+    finally:
+        delete_buildings(building_id)
+
+
+def test_get_organizations_by_geo_radius_paged():
+    """Тест постраничной выдачи по радиусу в порядке удаления."""
+    payload = {"latitude": 55.7522, "longitude": 37.6156, "radius_km": 10.0}
+    response = requests.post(f"{BASE_URL}/organizations/by_geo/", json=payload, headers=HEADERS)
+    full = response.json()
+    distances = [org["distance_km"] for org in full]
+    assert distances == sorted(distances)
+
+    pages, after = [], None
+    while True:
+        response = requests.post(f"{BASE_URL}/organizations/by_geo/",
+                                 json={**payload, "limit": 2, "after": after}, headers=HEADERS)
+        assert response.status_code == 200
+        assert len(response.json()) <= 2
+        pages.extend(response.json())
+        if not (after := response.headers.get("X-Next-Cursor")):
+            break
+    assert [org["id"] for org in pages] == [org["id"] for org in full]
+
+    # Тест с некорректным курсором
+    response = requests.post(f"{BASE_URL}/organizations/by_geo/", json={**payload, "after": "???"}, headers=HEADERS)
+    assert response.status_code == 400
+
+
+def test_get_organizations_by_geo_radius_fast():
+    """Тест поиска в радиусе со сферическим расчётом расстояний."""
+    payload = {
+        "latitude": 55.7522,
+        "longitude": 37.6156,
+        "radius_km": 10.0,
+        "accuracy": "fast"
+    }
+    response = requests.post(f"{BASE_URL}/organizations/by_geo/", json=payload, headers=HEADERS)
+    assert response.status_code == 200
+    assert any(org["id"] == ORGANIZATION_ID for org in response.json())
+
+    # Неизвестный режим точности
+    payload["accuracy"] = "approximate"
+    response = requests.post(f"{BASE_URL}/organizations/by_geo/", json=payload, headers=HEADERS)
+    assert response.status_code == 422
+
+
 def test_get_organizations_by_geo_rectangle():
     """Тест получения организаций в прямоугольной области."""
     payload = {
@@ -89,6 +173,86 @@ def test_get_organizations_by_geo_rectangle():
     assert response.status_code == 400
 
 
+def test_get_organizations_by_geo_polygons():
+    """Тест получения организаций внутри многоугольников."""
+    triangle = [
+        {"latitude": 55.74, "longitude": 37.60},
+        {"latitude": 55.76, "longitude": 37.60},
+        {"latitude": 55.75, "longitude": 37.63},
+    ]
+    far = [{"latitude": lat, "longitude": lon} for lat, lon in [(0.0, 0.0), (0.1, 0.0), (0.1, 0.1)]]
+    response = requests.post(f"{BASE_URL}/organizations/by_geo/", json={"polygons": [far, triangle]}, headers=HEADERS)
+    assert response.status_code == 200
+    data = response.json()
+    assert any(org["id"] == ORGANIZATION_ID for org in data)
+    assert len({org["id"] for org in data}) == len(data)
+
+    # Тест потоковой выдачи - те же организации
+    response = requests.post(f"{BASE_URL}/organizations/by_geo/", json={"polygons": [far, triangle]},
+                             headers={**HEADERS, "Accept": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == [org["id"] for org in data]
+
+    # Тест с областью без зданий
+    response = requests.post(f"{BASE_URL}/organizations/by_geo/", json={"polygons": [far]}, headers=HEADERS)
+    assert response.status_code == 404
+
+    # Тест с вырожденным многоугольником
+    response = requests.post(f"{BASE_URL}/organizations/by_geo/", json={"polygons": [far[:2]]}, headers=HEADERS)
+    assert response.status_code == 422
+
+
+def test_get_nearest_organizations():
+    """Тест поиска k ближайших организаций."""
+    payload = {"latitude": 55.7522, "longitude": 37.6156, "k": 2}
+    response = requests.post(f"{BASE_URL}/organizations/nearest/", json=payload, headers=HEADERS)
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data) == 2
+    assert data[0]["distance_km"] <= data[1]["distance_km"]
+    assert data[0]["building_id"] == BUILDING_ID
+
+    # Тест с некорректным k
+    payload["k"] = 0
+    response = requests.post(f"{BASE_URL}/organizations/nearest/", json=payload, headers=HEADERS)
+    assert response.status_code == 422
+
+
+def test_get_organizations_tile():
+    """Тест кластеров организаций для тайла карты."""
+    response = requests.get(f"{BASE_URL}/organizations/tiles/0/0/0/", headers=HEADERS)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["count"] >= 3
+    assert data["count"] == sum(cell["count"] for cell in data["cells"])
+
+    # Тест с тайлом вне сетки
+    response = requests.get(f"{BASE_URL}/organizations/tiles/1/2/0/", headers=HEADERS)
+    assert response.status_code == 400
+
+
+def test_get_activity_facets():
+    """Тест счётчиков организаций по поддеревьям видов деятельности."""
+    response = requests.post(f"{BASE_URL}/organizations/facets/", json={}, headers=HEADERS)
+    assert response.status_code == 200
+    counts = {facet["id"]: facet["count"] for facet in response.json()}
+    tree = requests.get(f"{BASE_URL}/organizations/by_activity_tree/{ROOT_ACTIVITY_ID}/", headers=HEADERS)
+    assert counts[ROOT_ACTIVITY_ID] == len(tree.json())
+
+    # Только организации здания
+    payload = {"building_id": BUILDING_ID}
+    response = requests.post(f"{BASE_URL}/organizations/facets/", json=payload, headers=HEADERS)
+    assert response.status_code == 200
+    in_building = {facet["id"]: facet["count"] for facet in response.json()}
+    assert 1 <= in_building[ROOT_ACTIVITY_ID] <= counts[ROOT_ACTIVITY_ID]
+
+    # Область без зданий
+    payload = {"latitude": 0.0, "longitude": 0.0, "radius_km": 1.0}
+    response = requests.post(f"{BASE_URL}/organizations/facets/", json=payload, headers=HEADERS)
+    assert response.status_code == 200
+    assert all(facet["count"] == 0 for facet in response.json())
+
+
 def test_get_organization_by_id():
     """Тест получения организации по ID."""
     response = requests.get(f"{BASE_URL}/organizations/{ORGANIZATION_ID}", headers=HEADERS)
@@ -102,6 +266,67 @@ def test_get_organization_by_id():
     assert response.json()["detail"] == "Организация не найдена"
 
 
+def test_get_organization_include():
+    """Тест подгрузки связанных данных параметром include."""
+    params = {"include": "phones,activities,building"}
+    response = requests.get(f"{BASE_URL}/organizations/{ORGANIZATION_ID}/", params=params, headers=HEADERS)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["building"]["id"] == BUILDING_ID
+    assert ACTIVITY_ID in [activity["id"] for activity in data["activities"]]
+    assert all("phone_number" in phone for phone in data["phone_numbers"])
+
+    # Без include связанные данные не загружаются
+    response = requests.get(f"{BASE_URL}/organizations/{ORGANIZATION_ID}/", headers=HEADERS)
+    assert response.json()["building"] is None
+
+    response = requests.get(f"{BASE_URL}/organizations/{ORGANIZATION_ID}/", params={"include": "owner"},
+                            headers=HEADERS)
+    assert response.status_code == 400
+
+
+def test_get_organization_etag():
+    """Тест условного GET по ETag."""
+    payload = {"name": "Компания для ETag", "building_id": BUILDING_ID, "phone_numbers": [], "activity_ids": []}
+    organization_id = requests.post(f"{BASE_URL}/organizations/", json=payload, headers=HEADERS).json()["id"]
+    url = f"{BASE_URL}/organizations/{organization_id}/"
+    response = requests.get(url, headers=HEADERS)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    response = requests.get(url, headers={**HEADERS, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+    # После изменения организации старый ETag не подходит
+    requests.patch(url, json={"name": "Компания для ETag 2"}, headers=HEADERS)
+    response = requests.get(url, headers={**HEADERS, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json()["name"] == "Компания для ETag 2"
+    requests.delete(url, headers=HEADERS)
+
+
+def test_response_cache():
+    """Тест кэша ответов: повторный запрос отдаётся из кэша, запись сбрасывается изменением."""
+    url = f"{BASE_URL}/organizations/by_building/{BUILDING_ID}/"
+    first = requests.get(url, headers=HEADERS)
+    hits = requests.get(f"{BASE_URL}/debug/cache/").json()["hits"]
+    second = requests.get(url, headers=HEADERS)
+    assert second.status_code == 200
+    assert second.content == first.content
+    assert second.headers["ETag"] == first.headers["ETag"]
+    stats = requests.get(f"{BASE_URL}/debug/cache/").json()
+    assert stats["hits"] == hits + 1
+    assert len(second.content) <= stats["bytes"] <= stats["max_bytes"]
+
+    payload = {"name": "Компания для кэша", "building_id": BUILDING_ID, "phone_numbers": [], "activity_ids": []}
+    organization_id = requests.post(f"{BASE_URL}/organizations/", json=payload, headers=HEADERS).json()["id"]
+    assert organization_id in [org["id"] for org in requests.get(url, headers=HEADERS).json()]
+    requests.delete(f"{BASE_URL}/organizations/{organization_id}/", headers=HEADERS)
+    assert organization_id not in [org["id"] for org in requests.get(url, headers=HEADERS).json()]
+
+
 def test_get_organizations_by_activity_tree():
     """Тест получения организаций по дереву деятельности (Еда)."""
     response = requests.get(f"{BASE_URL}/organizations/by_activity_tree/{ROOT_ACTIVITY_ID}/", headers=HEADERS)
@@ -117,6 +342,47 @@ def test_get_organizations_by_activity_tree():
     assert response.json()["detail"] == "No organizations found for this activity tree"
 
 
+def test_get_organizations_by_activity_tree_paged():
+    """Тест постраничной выдачи по курсору."""
+    url = f"{BASE_URL}/organizations/by_activity_tree/{ROOT_ACTIVITY_ID}/"
+    expected = sorted(org["id"] for org in requests.get(url, headers=HEADERS).json())
+    pages, params = [], {"limit": 1}
+    while True:
+        response = requests.get(url, params=params, headers=HEADERS)
+        assert response.status_code == 200
+        assert len(response.json()) == 1
+        pages.extend(org["id"] for org in response.json())
+        if not (cursor := response.headers.get("X-Next-Cursor")):
+            break
+        params["after"] = cursor
+    assert pages == expected
+
+    # Поиск по названию листается в порядке похожести
+    url = f"{BASE_URL}/organizations/by_name/о/"
+    first = requests.get(url, params={"limit": 1}, headers=HEADERS)
+    second = requests.get(url, params={"limit": 1, "after": first.headers["X-Next-Cursor"]}, headers=HEADERS)
+    assert second.status_code == 200
+    assert second.json()[0]["id"] != first.json()[0]["id"]
+
+    response = requests.get(url, params={"after": "не курсор"}, headers=HEADERS)
+    assert response.status_code == 400
+
+
+def test_get_organizations_ndjson():
+    """Тест потоковой выдачи NDJSON."""
+    url = f"{BASE_URL}/organizations/by_activity_tree/{ROOT_ACTIVITY_ID}/"
+    expected = [org["id"] for org in requests.get(url, params={"limit": 100}, headers=HEADERS).json()]
+    response = requests.get(url, headers={**HEADERS, "Accept": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == expected
+
+    # Пустая выборка - 404, как и без потока
+    response = requests.get(f"{BASE_URL}/organizations/by_building/{str(UUID(int=0))}/",
+                            headers={**HEADERS, "Accept": "application/x-ndjson"})
+    assert response.status_code == 404
+
+
 def test_get_organizations_by_name():
     """Тест поиска организаций по имени."""
     response = requests.get(f"{BASE_URL}/organizations/by_name/Рога/", headers=HEADERS)
@@ -126,12 +392,38 @@ def test_get_organizations_by_name():
     assert len(data) >= 1
     assert data[0]["id"] == ORGANIZATION_ID
 
+    # Регистр и опечатка
+    response = requests.get(f"{BASE_URL}/organizations/by_name/КАПЫТА/", headers=HEADERS)
+    assert response.status_code == 200
+    assert response.json()[0]["id"] == ORGANIZATION_ID
+
+    # Ограничение числа результатов
+    response = requests.get(f"{BASE_URL}/organizations/by_name/о/", params={"limit": 1}, headers=HEADERS)
+    assert response.status_code == 200
+    assert len(response.json()) == 1
+
     # Тест с несуществующим именем
     response = requests.get(f"{BASE_URL}/organizations/by_name/Несуществующая/", headers=HEADERS)
     assert response.status_code == 404
     assert response.json()["detail"] == "Не найдена организация по названию"
 
 
+def test_autocomplete_organization_names():
+    """Тест подсказок названий организаций."""
+    response = requests.get(f"{BASE_URL}/organizations/autocomplete/", params={"q": "рог"}, headers=HEADERS)
+    assert response.status_code == 200
+    assert response.json()[0]["id"] == ORGANIZATION_ID
+
+    # Начало названия идёт раньше начала другого слова
+    response = requests.get(f"{BASE_URL}/organizations/autocomplete/", params={"q": "о"}, headers=HEADERS)
+    assert response.status_code == 200
+    assert response.json()[0]["name"] == "ООО Рога и Копыта"
+
+    response = requests.get(f"{BASE_URL}/organizations/autocomplete/", params={"q": "щщщ"}, headers=HEADERS)
+    assert response.status_code == 200
+    assert response.json() == []
+
+
 def test_create_organization():
     """Тест создания новой организации."""
     new_organization_id = str(UUID(int=123456789))
@@ -154,6 +446,82 @@ def test_create_organization():
     assert response.json()["detail"] == "Здание не найдено"
 
 
+def test_create_organizations_bulk():
+    """Тест пакетного создания организаций."""
+    item = {"building_id": BUILDING_ID, "phone_numbers": ["1-111-111"], "activity_ids": [ACTIVITY_ID]}
+    payload = {"organizations": [
+        {**item, "name": "Пакетная Компания 1"},
+        {**item, "name": "Пакетная Компания 2", "building_id": str(UUID(int=0))},
+        {**item, "name": "Пакетная Компания 3", "activity_ids": [str(UUID(int=0))]},
+        {**item, "name": "Пакетная Компания 4", "phone_numbers": []},
+    ]}
+    response = requests.post(f"{BASE_URL}/organizations/bulk/", json=payload, headers=HEADERS)
+    assert response.status_code == 207
+    data = response.json()
+    assert (data["created"], data["failed"]) == (2, 2)
+    assert [item["status"] for item in data["items"]] == [201, 404, 404, 201]
+    assert data["items"][1]["detail"] == "Здание не найдено"
+
+    created = requests.get(f"{BASE_URL}/organizations/{data['items'][0]['id']}/",
+                           params={"include": "phones,activities"}, headers=HEADERS).json()
+    assert created["name"] == "Пакетная Компания 1"
+    assert created["phone_numbers"] == [{"phone_number": "1-111-111"}]
+    assert [activity["id"] for activity in created["activities"]] == [ACTIVITY_ID]
+    for item in data["items"]:
+        if item["id"]:
+            requests.delete(f"{BASE_URL}/organizations/{item['id']}/", headers=HEADERS)
+
+
+def test_import_organizations():
+    """Тест импорта справочника из NDJSON и CSV."""
+    building_id, organization_id = str(uuid4()), str(uuid4())
+    buildings = "\n".join(json.dumps(row) for row in [
+        {"id": building_id, "address": "г. Импорт, ул. Загрузки, 1", "latitude": 10.5, "longitude": 20.5},
+        {"address": "Без координат"},
+    ])
+    response = requests.post(f"{BASE_URL}/import/buildings/", headers=HEADERS,
+                             files={"file": ("buildings.ndjson", buildings, "application/x-ndjson")})
+    assert response.status_code == 200
+    report = response.json()
+    assert (report["rows"], report["imported"], report["rejected"]) == (2, 1, 1)
+    assert report["errors"][0]["line"] == 2
+
+    organizations = (f"id,name,building_id\n{organization_id},Импортная Компания,{building_id}\n"
+                     f",Без здания,{UUID(int=0)}\n")
+    response = requests.post(f"{BASE_URL}/import/organizations/", headers=HEADERS,
+                             files={"file": ("organizations.csv", organizations, "text/csv")})
+    report = response.json()
+    assert (report["imported"], report["rejected"]) == (1, 1)
+    assert report["errors"] == [{"line": 3, "detail": "building_id: запись не найдена"}]
+
+    links = (f"organization_id,activity_id\n{organization_id},{ACTIVITY_ID}\n{organization_id},{UUID(int=0)}\n"
+             f"{organization_id},{ACTIVITY_ID}\n")
+    response = requests.post(f"{BASE_URL}/import/activities/", headers=HEADERS,
+                             files={"file": ("links.csv", links, "text/csv")})
+    assert (response.json()["imported"], response.json()["rejected"]) == (1, 2)
+    assert response.json()["errors"][1] == {"line": 4, "detail": "organization_id, activity_id: запись уже существует"}
+
+    # повторы пар - и внутри файла, и с уже записанными
+    phones = f"organization_id,phone_number\n{organization_id},1-234-567\n{organization_id},1-234-567\n"
+    for imported in (1, 0):
+        response = requests.post(f"{BASE_URL}/import/phones/", headers=HEADERS,
+                                 files={"file": ("phones.csv", phones, "text/csv")})
+        assert (response.json()["imported"], response.json()["rejected"]) == (imported, 2 - imported)
+
+    response = requests.get(f"{BASE_URL}/organizations/by_building/{building_id}/", headers=HEADERS)
+    assert [org["id"] for org in response.json()] == [organization_id]
+    created = requests.get(f"{BASE_URL}/organizations/{organization_id}/",
+                           params={"include": "phones,activities"}, headers=HEADERS).json()
+    assert created["phone_numbers"] == [{"phone_number": "1-234-567"}]
+    assert [activity["id"] for activity in created["activities"]] == [ACTIVITY_ID]
+    requests.delete(f"{BASE_URL}/organizations/{organization_id}/", headers=HEADERS)
+    delete_buildings(building_id)
+
+    response = requests.post(f"{BASE_URL}/import/buildings/", headers=HEADERS,
+                             files={"file": ("buildings.xml", "<buildings/>", "application/xml")})
+    assert response.status_code == 415
+
+
 def test_update_organization():
     """Тест обновления организации."""
     payload = {
@@ -172,6 +540,35 @@ def test_update_organization():
     assert response.json()["detail"] == "Организация не найдена"
 
 
+def test_update_organization_links():
+    """Тест замены телефонов и видов деятельности при обновлении организации."""
+    payload = {
+        "name": "Компания для замены связей",
+        "building_id": BUILDING_ID,
+        "phone_numbers": ["1-000-001", "1-000-002"],
+        "activity_ids": [ACTIVITY_ID]
+    }
+    organization_id = requests.post(f"{BASE_URL}/organizations/", json=payload, headers=HEADERS).json()["id"]
+    url, params = f"{BASE_URL}/organizations/{organization_id}/", {"include": "phones,activities"}
+
+    update = {"phone_numbers": ["1-000-002", "1-000-003", "1-000-003"], "activity_ids": [ROOT_ACTIVITY_ID]}
+    for _ in range(2):  # повторное обновление ничего не меняет
+        assert requests.patch(url, json=update, headers=HEADERS).status_code == 200
+        data = requests.get(url, params=params, headers=HEADERS).json()
+        assert sorted(phone["phone_number"] for phone in data["phone_numbers"]) == ["1-000-002", "1-000-003"]
+        assert [activity["id"] for activity in data["activities"]] == [ROOT_ACTIVITY_ID]
+
+    by_activity = requests.get(f"{BASE_URL}/organizations/by_activity/{ACTIVITY_ID}/", headers=HEADERS).json()
+    assert organization_id not in [org["id"] for org in by_activity]
+
+    # Недопустимый вид деятельности отклоняется до изменения связей
+    response = requests.patch(url, json={"phone_numbers": [], "activity_ids": [str(UUID(int=0))]}, headers=HEADERS)
+    assert response.status_code == 404
+    data = requests.get(url, params=params, headers=HEADERS).json()
+    assert len(data["phone_numbers"]) == 2
+    requests.delete(url, headers=HEADERS)
+
+
 def test_delete_organization():
     """Тест мягкого удаления организации."""
     # Сначала создадим новую организацию для удаления
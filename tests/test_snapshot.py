@@ -0,0 +1,153 @@
+import asyncio
+import random
+from uuid import UUID
+
+from uuid6 import uuid7
+
+from src.db import journal as journal_module
+from src.db import memory
+from src.db import snapshot as snapshot_module
+from src.db.activities import ActivityNode, ActivityTree
+from src.db.journal import ChangeJournal
+from src.db.snapshot import Snapshot, SnapshotStore, write_snapshot
+from src.db.spatial import SpatialIndex
+from src.db.tiles import TileIndex
+
+
+def _data(count: int = 300):
+    """Случайные здания, организации и дерево видов деятельности из трёх уровней"""
+    rnd = random.Random(7)
+    buildings = {uuid7(): (rnd.uniform(55.5, 56.0), rnd.uniform(37.3, 37.9)) for _ in range(count)}
+    building_ids = list(buildings)
+    organizations = {uuid7(): rnd.choice(building_ids) for _ in range(2 * count)}
+    activities, parents = {}, [None]
+    for level in (1, 2, 3):
+        for parent in list(parents):
+            for _ in range(2):
+                activity_id = uuid7()
+                path = f"{activities[parent][4] if parent else '/'}{activity_id}/"
+                activities[activity_id] = (activity_id, f"Вид {level}", parent, level, path)
+                parents.append(activity_id)
+        parents = [activity_id for activity_id, row in activities.items() if row[3] == level]
+    return buildings, organizations, activities
+
+
+def _written(tmp_path, generation: int = 1):
+    data = _data()
+    write_snapshot(tmp_path / "snapshot.bin", generation, (1, 42), *data)
+    return Snapshot(tmp_path / "snapshot.bin"), data
+
+
+def test_snapshot_round_trip(tmp_path):
+    """Тест записи и чтения снимка: все разделы читаются так же, как записаны."""
+    snap, (buildings, organizations, activities) = _written(tmp_path)
+    assert snap.generation == 1 and snap.position == (1, 42)
+    assert {building_id: (lat, lon) for building_id, lat, lon in snap.buildings()} == buildings
+    assert dict(snap.organizations()) == organizations
+    assert list(snap.activities()) == sorted(activities.values(), key=lambda row: row[4])
+
+    building_id = next(iter(buildings))
+    assert snap.points[building_id] == buildings[building_id] and len(snap.points) == len(buildings)
+    activity_id = next(iter(activities))
+    assert snap.activity_nodes(ActivityNode).get(activity_id) == ActivityNode(*activities[activity_id])
+    assert snap.activity_nodes(ActivityNode).get(UUID(int=0)) is None
+
+
+def test_snapshot_indexes(tmp_path):
+    """Тест индексов поверх снимка: ответы совпадают с индексами, собранными в памяти процесса."""
+    snap, (buildings, organizations, activities) = _written(tmp_path)
+
+    in_memory, mapped = SpatialIndex(), SpatialIndex()
+    for building_id, (lat, lon) in buildings.items():
+        in_memory._put(building_id, lat, lon)
+    mapped._points, mapped._cells = snap.points, snap.grid
+    for box in [(55.6, 55.7, 37.4, 37.5), (55.0, 57.0, 37.0, 38.0), (10.0, 11.0, 10.0, 11.0)]:
+        assert sorted(mapped.in_box(*box)) == sorted(in_memory.in_box(*box))
+    assert list(mapped.nearest(55.75, 37.6, max_km=5)) == list(in_memory.nearest(55.75, 37.6, max_km=5))
+
+    tiles_memory, tiles_mapped = TileIndex(), TileIndex()
+    counts = {}
+    for building_id in organizations.values():
+        counts[building_id] = counts.get(building_id, 0) + 1
+    for building_id, count in counts.items():
+        tiles_memory._put(building_id, *buildings[building_id], count)
+    tiles_mapped._cells = snap.tiles
+    assert tiles_memory.tile(12, 2475, 1280)
+    for z, x, y in [(0, 0, 0), (8, 154, 80), (12, 2475, 1280), (18, 0, 0)]:
+        expected, actual = tiles_memory.tile(z, x, y), tiles_mapped.tile(z, x, y)
+        assert [(c["x"], c["y"], c["count"]) for c in actual] == [(c["x"], c["y"], c["count"]) for c in expected]
+        assert all(abs(a["latitude"] - e["latitude"]) < 1e-9 for a, e in zip(actual, expected, strict=True))
+
+    tree_memory, tree_mapped = ActivityTree(), ActivityTree()
+    nodes = [ActivityNode(*row) for row in sorted(activities.values(), key=lambda row: row[4])]
+    tree_memory._nodes = {node.id: node for node in nodes}
+    tree_memory._paths, tree_memory._ordered = [node.path for node in nodes], [node.id for node in nodes]
+    for node in nodes:
+        if node.parent_id:
+            tree_memory._children.setdefault(node.parent_id, []).append(node.id)
+    tree_mapped._nodes, tree_mapped._children = snap.activity_nodes(ActivityNode), snap.activity_children
+    tree_mapped._paths, tree_mapped._ordered = snap.activity_paths, snap.activity_ids
+    assert tree_mapped.nodes(max_level=2) == tree_memory.nodes(max_level=2)
+    for node in nodes:
+        assert tree_mapped.subtree(node.id) == tree_memory.subtree(node.id)
+        assert tree_mapped.children(node.id) == tree_memory.children(node.id)
+        assert tree_mapped.ancestors(node.id) == tree_memory.ancestors(node.id)
+    for index in (in_memory, mapped, tiles_memory, tiles_mapped, tree_memory, tree_mapped):
+        memory._indexes.remove(index)
+
+
+def test_snapshot_generation_swap(tmp_path, monkeypatch):
+    """Тест смены поколения: указатель переходит на новый файл, старый удаляется,
+    но уже открытое поколение читается до конца."""
+    monkeypatch.setattr(snapshot_module, "journal", ChangeJournal(str(tmp_path)))
+    store = SnapshotStore(str(tmp_path))
+    memory._indexes.remove(store)
+    buildings, organizations, activities = _data(10)
+    store._publish((1, 10), buildings, organizations, activities)
+    first = store.snapshot
+    moved = {**buildings, next(iter(buildings)): (0.0, 0.0)}
+    store._publish((1, 20), moved, organizations, activities)
+
+    assert store.snapshot.generation == first.generation + 1 == 2
+    assert store._current().position == (1, 20)
+    assert [path.name for path in tmp_path.glob("snapshot-*.bin")] == ["snapshot-000000000002.bin"]
+    assert {building_id: (lat, lon) for building_id, lat, lon in first.buildings()} == buildings
+    assert store.snapshot.points[next(iter(buildings))] == (0.0, 0.0)
+
+    # поколение со всеми известными процессу изменениями подключается без запросов в БД
+    asyncio.run(store._update(None, store._current()))
+    assert store.snapshot.generation == 2
+
+
+def test_journal_sync_changes(tmp_path, monkeypatch):
+    """Тест журнала: строки другого процесса помечают записи индексов и меняют версии таблиц,
+    свои строки не перечитываются, пропуск файла журнала перезагружает индексы целиком."""
+    monkeypatch.setattr(journal_module, "MAX_SIZE", 400)
+    ours, theirs = ChangeJournal(str(tmp_path)), ChangeJournal(str(tmp_path))
+    monkeypatch.setattr(memory, "journal", ours)
+
+    class Probe(memory.MemoryIndex):
+        pass
+
+    probe = Probe()
+    probe._loaded = True
+    try:
+        ours.open()
+        start = ours.position
+        before = memory.table_versions("organization_phone")
+        ours.append(["organization"], {"Probe": [str(UUID(int=1))]})
+        theirs.append(["organization_phone"], {"Probe": [str(UUID(int=2))]})
+        asyncio.run(memory.sync_changes())
+        assert probe._pending == {UUID(int=2)}
+        assert memory.table_versions("organization_phone")[1:] == (before[1] + 1,)
+        assert ours.changes(start, ours.end(), "Probe") == {UUID(int=1), UUID(int=2)}
+
+        # журнал сменился дважды, пока процесс его не читал
+        probe._pending = set()
+        for _ in range(10):
+            theirs.append(["organization"], {"Probe": [str(uuid7())]})
+        epoch = memory.table_versions()[0]
+        asyncio.run(memory.sync_changes())
+        assert probe._pending is None and memory.table_versions()[0] == epoch + 1
+    finally:
+        memory._indexes.remove(probe)